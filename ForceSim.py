@@ -0,0 +1,109 @@
+from MagSim import SimMode, calc_forces, calc_forces_bh, calc_force_scale, calc_moments
+from graph import Graph
+import numpy as np
+
+SPRING_STRENGTH = 1         # How hard edges pull their vertices together.
+# Temperatures are in spring lengths.
+START_TEMPERATURE = 0.3     # Max distance a vertex can move in the first step.
+COOLING = 0.95              # Temperature is multiplied by this every step.
+MIN_TEMPERATURE = 0.001     # The layout is done once the temperature gets this low.
+# Graphs with more vertices than this use Barnes-Hut for the magnetic repulsion.
+BARNES_HUT_MIN_SIZE = 2000
+
+# Force directed layout: vertices repel each other like magnets (see MagSim), and edges
+# pull their vertices together like springs. Like Fruchterman-Reingold, both are scaled
+# by the spring length: an edge pulls with spring_strength * d^2 / spring_length, and
+# the magnetic repulsion is scaled so that two vertices of average degree a spring
+# length apart push each other as hard as the edge between them would pull. Starts from
+# the spectral layout of the graph (or the given coords, e.g. from a LayoutWorker
+# result), scaled to fit -1 to 1. Every step, no vertex moves further than the current
+# temperature, which cools down over time.
+class ForceSim:
+    def __init__(self, graph : Graph, spring_strength : float = SPRING_STRENGTH,
+            spring_length : float = None, start_temperature : float = START_TEMPERATURE,
+            cooling : float = COOLING, min_temperature : float = MIN_TEMPERATURE,
+            repulsion_mode : int = None, coords : np.array = None) -> None:
+        self.graph : Graph = graph
+        self.spring_strength : float = spring_strength
+        # None means spread the vertices evenly over the -1 to 1 square.
+        self.spring_length : float = spring_length
+        self.start_temperature : float = start_temperature
+        self.cooling : float = cooling
+        self.min_temperature : float = min_temperature
+        # SimMode.VECTOR or SimMode.BARNES_HUT. None picks based on the graph size.
+        self.repulsion_mode : int = repulsion_mode
+
+        self.version : int = -1     # Graph version the coords are for.
+        self.coords : np.array = None
+        self.temperature : float = start_temperature
+        self.reset(coords)
+
+    # Starts over from the given coords, or the spectral layout of the graph if None.
+    def reset(self, coords : np.array = None) -> None:
+        if coords is None: coords = self.graph.get_coords()
+        coords = np.array(coords, dtype = np.float64)
+        if coords.size:
+            coords -= coords.mean(axis = 0)
+            coords /= max(np.abs(coords).max(), 1e-12)
+        self.coords = coords
+        self.degrees : np.array = self.graph.get_degrees()
+        self.length : float = self.spring_length
+        if self.length is None: self.length = 2 / np.sqrt(max(len(coords), 1))
+        # Magnetic force of two average vertices a spring length apart.
+        moment = calc_moments(self.degrees).mean() if len(coords) else 1
+        magnet = calc_force_scale(np.array(self.length), np.array(0.0), moment, moment) * self.length
+        self.repulsion : float = self.spring_strength * self.length / magnet
+        self.temperature = self.start_temperature * self.length
+        self.version = self.graph.version
+
+    # Whether the layout has cooled down and won't change much more.
+    def is_done(self) -> bool:
+        return self.temperature <= self.min_temperature * self.length
+
+    # Moves every vertex once, and returns the new coords.
+    def step(self) -> np.array:
+        if self.version != self.graph.version: self.reset()
+        n = len(self.coords)
+        if n < 2: return self.coords
+
+        mode = self.repulsion_mode
+        if mode is None: mode = SimMode.BARNES_HUT if n > BARNES_HUT_MIN_SIZE else SimMode.VECTOR
+        if mode == SimMode.BARNES_HUT: move = calc_forces_bh(self.coords, self.degrees)
+        else: move = calc_forces(self.coords, self.degrees)
+
+        move = move * self.repulsion + self.calc_spring_forces()
+
+        # Cap how far each vertex can move
+        dist = np.sqrt(np.sum(move * move, axis = 1))
+        too_far = dist > self.temperature
+        move[too_far] *= (self.temperature / dist[too_far])[:, None]
+
+        self.coords = self.coords + move
+        self.temperature = max(self.temperature * self.cooling, self.min_temperature * self.length)
+        return self.coords
+
+    # Runs up to the given number of steps (stopping early once cooled), and returns
+    # the coords.
+    def run(self, steps : int = 100) -> np.array:
+        for _ in range(steps):
+            self.step()
+            if self.is_done(): break
+        return self.coords
+
+    # Pulls both ends of every edge together with spring_strength * d^2 / length.
+    def calc_spring_forces(self) -> np.array:
+        (rows, cols) = self.graph.get_edge_index()
+        n = len(self.coords)
+
+        diff = self.coords[cols] - self.coords[rows]
+        dist = np.sqrt(np.sum(diff * diff, axis = 1))
+        # Per unit of diff, so d / length.
+        pull = self.spring_strength * dist / self.length
+        (x_pull, y_pull) = (pull * diff[:, 0], pull * diff[:, 1])
+
+        forces = np.zeros((n, 2))
+        forces[:, 0] = (np.bincount(rows, weights = x_pull, minlength = n)
+            - np.bincount(cols, weights = x_pull, minlength = n))
+        forces[:, 1] = (np.bincount(rows, weights = y_pull, minlength = n)
+            - np.bincount(cols, weights = y_pull, minlength = n))
+        return forces
@@ -1,10 +1,33 @@
 from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, get_context
+import numpy as np
+import atexit
 import math
+import os
 
 POLARITY = 1                # 1: Magnets have same polarity and repell, -1: magnets have opposite and attract
 PERMEABILITY = 0.03         # Less permeability means less magnetic force.
 MOMENT_MUL = 0.2              # Strength of moments.
 
+# Max number of pairs the vectorized kernel works on at once. Bounds memory use to a
+# few arrays of this many floats.
+MAX_BLOCK_PAIRS = 2**22
+
+# Barnes-Hut: a cell of the quadtree is treated as one big magnet at its center of
+# moment if (cell width / distance) < THETA. Smaller is more accurate but slower.
+THETA = 0.5
+MAX_TREE_DEPTH = 16
+# Number of objects the Barnes-Hut kernel walks the tree for at once.
+BH_BLOCK_SIZE = 4096
+
+# Enum for how update_objects computes the forces
+class SimMode:
+    LOOP = 0        # Pure python, one pair at a time
+    VECTOR = 1      # Numpy, all pairs, a block of rows at a time
+    BARNES_HUT = 2  # Numpy, quadtree approximation of far away objects, O(n log n)
+    PARALLEL = 3    # Same as VECTOR, but split over a pool of processes
+
 # F = (u/4pi) * (m1*m2/r^2)
 # Returns the displacment the object should receive, in x-y tuple
 def apply_mag(object : List[int], other : List[int], m1 : int, m2 : int) -> List[int]:
@@ -26,8 +49,24 @@ def apply_mag(object : List[int], other : List[int], m1 : int, m2 : int) -> List
     y_mul = (object[1] - other[1])/dist if dist != 0 else (object[0] - other[0])/0.001
     return [POLARITY*F*x_mul, POLARITY*F*y_mul]
 
-# Returns list of objects after applying magnetic forces onece
-def update_objects(objects : List[List[int]], degrees) -> List[List[int]]:
+# Returns list of objects after applying magnetic forces onece. Modes other than LOOP
+# return an (n, 2) array instead of a list of lists.
+def update_objects(objects : List[List[int]], degrees, mode : int = SimMode.LOOP) -> List[List[int]]:
+    match mode:
+        case SimMode.LOOP: pass
+        case SimMode.VECTOR:
+            coords = np.asarray(objects, dtype = np.float64)
+            return coords + calc_forces(coords, degrees)
+        case SimMode.BARNES_HUT:
+            coords = np.asarray(objects, dtype = np.float64)
+            return coords + calc_forces_bh(coords, degrees)
+        case SimMode.PARALLEL:
+            coords = np.asarray(objects, dtype = np.float64)
+            return coords + get_parallel_sim().calc_forces(coords, degrees)
+        case _:
+            print(f"ERROR: Invalid mode {mode}.")
+            return None
+
     new_objs = []
 
     o_i = 0
@@ -52,4 +91,258 @@ def update_object(object : Tuple[int], others : List[List[int]]) -> Tuple[int]:
         new_move = apply_mag(object, other)
         to_move[0] += new_move[0]
         to_move[1] += new_move[1]
-    return ([object[0] + to_move[0], object[1] + to_move[1]])
\ No newline at end of file
+    return ([object[0] + to_move[0], object[1] + to_move[1]])
+
+# Moment of each object from its degree, like in apply_mag.
+def calc_moments(degrees : np.array) -> np.array:
+    moments = np.asarray(degrees, dtype = np.float64)
+    return np.where(moments == 0, 1, moments) * MOMENT_MUL
+
+# Vectorized part of apply_mag: returns F / dist for arrays of pairs, so that the force
+# is (F * x_dist, F * y_dist). Moments should already be multiplied by MOMENT_MUL.
+def calc_force_scale(x_dist : np.array, y_dist : np.array, m1 : np.array,
+        m2 : np.array) -> np.array:
+    dist = np.sqrt(x_dist * x_dist + y_dist * y_dist)
+    d = 4 * math.pi * dist * dist * dist
+    d = np.where(np.round(d, 6) == 0, PERMEABILITY * 5, d)
+    # Same as x_mul / y_mul in apply_mag. Both are 0 when dist is 0.
+    return PERMEABILITY * m1 * m2 / d / np.where(dist != 0, dist, 0.001)
+
+# Vectorized apply_mag for every pair of objects. Coords is an (n, 2) array and degrees
+# has one value per object. Returns the (n, 2) array of displacements, the same as
+# update_objects would add to each object. If first and last are given, only the
+# displacements of objects first to last (exclusive) are returned.
+def calc_forces(coords : np.array, degrees : np.array, first : int = 0,
+        last : int = None) -> np.array:
+    coords = np.asarray(coords, dtype = np.float64)
+    n = len(coords)
+    if last is None: last = n
+    moments = calc_moments(degrees)
+
+    forces = np.zeros((last - first, 2))
+    block_rows = max(1, MAX_BLOCK_PAIRS // max(n, 1))
+    for start in range(first, last, block_rows):
+        end = min(start + block_rows, last)
+        x_dist = coords[start:end, 0, None] - coords[None, :, 0]
+        y_dist = coords[start:end, 1, None] - coords[None, :, 1]
+        F = calc_force_scale(x_dist, y_dist, moments[start:end, None], moments[None, :])
+        rows = np.arange(end - start)
+        F[rows, rows + start] = 0   # Objects don't push themselves
+
+        forces[start - first:end - first, 0] = POLARITY * np.sum(F * x_dist, axis = 1)
+        forces[start - first:end - first, 1] = POLARITY * np.sum(F * y_dist, axis = 1)
+    return forces
+
+# Spreads the bits of 16 bit integers out so that two can be interleaved.
+def spread_bits(x : np.array) -> np.array:
+    x = x.astype(np.uint64) & 0xFFFF
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x33333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x55555555)
+    return x
+
+# One level of a QuadTree. Cells are runs of objects (sorted by morton code) that share
+# the same code prefix.
+class QuadLevel:
+    def __init__(self, codes : np.array, shift : int, width : float, coords : np.array,
+            moments : np.array) -> None:
+        prefixes = codes >> np.uint64(shift)
+        boundaries = np.flatnonzero(prefixes[1:] != prefixes[:-1]) + 1
+        self.shift : np.uint64 = np.uint64(shift)
+        self.width : float = width
+        self.starts : np.array = np.concatenate(([0], boundaries))
+        self.ends : np.array = np.concatenate((boundaries, [len(codes)]))
+        self.counts : np.array = self.ends - self.starts
+        self.prefixes : np.array = prefixes[self.starts]
+
+        # Total moment and center of moment of each cell
+        self.moments : np.array = np.add.reduceat(moments, self.starts)
+        weighted = np.add.reduceat(coords * moments[:, None], self.starts)
+        self.centers : np.array = weighted / self.moments[:, None]
+
+        # Range of child cells in the next level, filled in by QuadTree.
+        self.child_starts : np.array = None
+        self.child_ends : np.array = None
+
+# Quadtree over a set of objects for the Barnes-Hut approximation. Objects are sorted
+# by morton code, so every cell is a contiguous range of them.
+class QuadTree:
+    def __init__(self, coords : np.array, moments : np.array,
+            max_depth : int = MAX_TREE_DEPTH) -> None:
+        low = coords.min(axis = 0)
+        size = max((coords.max(axis = 0) - low).max(), 1e-12) * (1 + 1e-9)
+        cells = np.floor((coords - low) / size * (1 << max_depth)).astype(np.int64)
+        cells = np.clip(cells, 0, (1 << max_depth) - 1)
+        codes = spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << np.uint64(1))
+
+        self.order : np.array = np.argsort(codes, kind = "stable")
+        self.codes : np.array = codes[self.order]
+        self.coords : np.array = coords[self.order]
+        self.moments : np.array = moments[self.order]
+
+        self.levels : List[QuadLevel] = []
+        for depth in range(max_depth + 1):
+            level = QuadLevel(self.codes, 2 * (max_depth - depth), size / (1 << depth),
+                self.coords, self.moments)
+            self.levels.append(level)
+            # No need to go deeper once every object has its own cell.
+            if level.counts.max() == 1: break
+        for (parent, child) in zip(self.levels, self.levels[1:]):
+            parent.child_starts = np.searchsorted(child.starts, parent.starts)
+            parent.child_ends = np.searchsorted(child.starts, parent.ends)
+        # The last level is all leaves, so its cells have no children.
+        self.levels[-1].child_starts = np.zeros(len(self.levels[-1].starts), dtype = np.int64)
+        self.levels[-1].child_ends = self.levels[-1].child_starts
+
+    # Returns the displacement of every object (in sorted order), approximating cells
+    # that are far enough away using theta.
+    def calc_forces(self, theta : float = THETA, block_size : int = BH_BLOCK_SIZE) -> np.array:
+        n = len(self.coords)
+        forces = np.zeros((n, 2))
+        for block_start in range(0, n, block_size):
+            objs = np.arange(block_start, min(block_start + block_size, n))
+            cells = np.zeros(objs.size, dtype = np.int64)
+            for (depth, level) in enumerate(self.levels):
+                if objs.size == 0: break
+                x_dist = self.coords[objs, 0] - level.centers[cells, 0]
+                y_dist = self.coords[objs, 1] - level.centers[cells, 1]
+                dist = np.sqrt(x_dist * x_dist + y_dist * y_dist)
+
+                # Cells containing the object itself always have to be opened.
+                inside = (self.codes[objs] >> level.shift) == level.prefixes[cells]
+                far = ~inside & (level.width < theta * dist)
+                F = calc_force_scale(x_dist[far], y_dist[far], self.moments[objs[far]],
+                    level.moments[cells[far]])
+                self.add_forces(forces, objs[far], F * x_dist[far], F * y_dist[far])
+
+                near = ~far
+                leaf = near & ((level.counts[cells] == 1) | (depth == len(self.levels) - 1))
+                self.add_exact_forces(forces, objs[leaf], level.starts[cells[leaf]],
+                    level.counts[cells[leaf]])
+
+                # Open up the rest into their children for the next level.
+                opened = near & ~leaf
+                (objs, cells) = expand_ranges(objs[opened], level.child_starts[cells[opened]],
+                    level.child_ends[cells[opened]])
+        return POLARITY * forces
+
+    # Exact forces on each object from every other object in a range of sorted objects.
+    def add_exact_forces(self, forces : np.array, objs : np.array, starts : np.array,
+            counts : np.array) -> None:
+        (objs, others) = expand_ranges(objs, starts, starts + counts)
+        not_self = objs != others
+        (objs, others) = (objs[not_self], others[not_self])
+        x_dist = self.coords[objs, 0] - self.coords[others, 0]
+        y_dist = self.coords[objs, 1] - self.coords[others, 1]
+        F = calc_force_scale(x_dist, y_dist, self.moments[objs], self.moments[others])
+        self.add_forces(forces, objs, F * x_dist, F * y_dist)
+
+    def add_forces(self, forces : np.array, objs : np.array, x_forces : np.array,
+            y_forces : np.array) -> None:
+        if objs.size == 0: return
+        forces[:, 0] += np.bincount(objs, weights = x_forces, minlength = len(forces))
+        forces[:, 1] += np.bincount(objs, weights = y_forces, minlength = len(forces))
+
+# Repeats each value in values once for every index in [starts, ends), and returns
+# (repeated values, indices).
+def expand_ranges(values : np.array, starts : np.array, ends : np.array) -> Tuple[np.array]:
+    counts = ends - starts
+    total = counts.sum()
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return (np.repeat(values, counts), np.repeat(starts, counts) + offsets)
+
+# Barnes-Hut version of calc_forces: O(n log n) instead of O(n^2), but cells that are
+# far away (see THETA) are approximated as one magnet.
+def calc_forces_bh(coords : np.array, degrees : np.array, theta : float = THETA) -> np.array:
+    coords = np.asarray(coords, dtype = np.float64)
+    if len(coords) < 2: return np.zeros((len(coords), 2))
+    tree = QuadTree(coords, calc_moments(degrees))
+    forces = np.empty((len(coords), 2))
+    forces[tree.order] = tree.calc_forces(theta)
+    return forces
+
+# ______________________________
+# ----- PARALLEL SIMULATION -----
+# ______________________________
+
+# Shared memory blocks that a worker process has opened, by name.
+worker_memory : dict = {}
+
+# Opens (or reuses) shared memory blocks in a worker process, and closes any blocks
+# from before the simulation last grew.
+def attach_memory(names : List[str]) -> List[shared_memory.SharedMemory]:
+    for old_name in [n for n in worker_memory if n not in names]:
+        worker_memory.pop(old_name).close()
+    for name in names:
+        if name not in worker_memory:
+            worker_memory[name] = shared_memory.SharedMemory(name = name)
+    return [worker_memory[name] for name in names]
+
+# Runs in a worker process: computes the displacements of objects first to last from
+# the shared inputs, and writes them to the shared output.
+def parallel_worker(in_name : str, out_name : str, capacity : int, n : int, first : int,
+        last : int) -> None:
+    (in_memory, out_memory) = attach_memory([in_name, out_name])
+    inputs = np.ndarray((3, capacity), dtype = np.float64, buffer = in_memory.buf)
+    outputs = np.ndarray((capacity, 2), dtype = np.float64, buffer = out_memory.buf)
+    coords = inputs[:2, :n].T
+    outputs[first:last] = calc_forces(coords, inputs[2, :n], first, last)
+
+# Computes the same displacements as calc_forces, split into chunks over a pool of
+# processes. Coords and degrees go through shared memory, so only the chunk bounds are
+# sent to the workers each step.
+class ParallelSim:
+    def __init__(self, workers : int = None) -> None:
+        self.workers : int = workers if workers is not None else os.cpu_count()
+        self.pool : ProcessPoolExecutor = ProcessPoolExecutor(self.workers,
+            mp_context = get_context("spawn"))
+        self.capacity : int = 0
+        self.inputs : shared_memory.SharedMemory = None     # x, y and degree rows
+        self.outputs : shared_memory.SharedMemory = None    # (capacity, 2) displacements
+
+    # Makes sure the shared memory can hold n objects.
+    def reserve(self, n : int) -> None:
+        if n <= self.capacity: return
+        self.free_memory()
+        self.capacity = max(n, self.capacity * 2)
+        self.inputs = shared_memory.SharedMemory(create = True, size = 3 * 8 * self.capacity)
+        self.outputs = shared_memory.SharedMemory(create = True, size = 2 * 8 * self.capacity)
+
+    def calc_forces(self, coords : np.array, degrees : np.array) -> np.array:
+        coords = np.asarray(coords, dtype = np.float64)
+        n = len(coords)
+        if n == 0: return np.zeros((0, 2))
+        self.reserve(n)
+        inputs = np.ndarray((3, self.capacity), dtype = np.float64, buffer = self.inputs.buf)
+        inputs[:2, :n] = coords.T
+        inputs[2, :n] = degrees
+
+        bounds = np.linspace(0, n, min(self.workers, n) + 1).astype(int)
+        jobs = [self.pool.submit(parallel_worker, self.inputs.name, self.outputs.name,
+            self.capacity, n, first, last) for (first, last) in zip(bounds, bounds[1:])]
+        for job in jobs: job.result()
+
+        outputs = np.ndarray((self.capacity, 2), dtype = np.float64, buffer = self.outputs.buf)
+        return outputs[:n].copy()
+
+    def free_memory(self) -> None:
+        for memory in (self.inputs, self.outputs):
+            if memory is None: continue
+            memory.close()
+            memory.unlink()
+        (self.inputs, self.outputs, self.capacity) = (None, None, 0)
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        self.free_memory()
+
+# Shared ParallelSim used by update_objects, created the first time it's needed.
+parallel_sim : ParallelSim = None
+
+def get_parallel_sim() -> ParallelSim:
+    global parallel_sim
+    if parallel_sim is None:
+        parallel_sim = ParallelSim()
+        atexit.register(parallel_sim.close)
+    return parallel_sim
@@ -0,0 +1,317 @@
+from graph import Graph, EigMode, EigSolver, solve_eigs
+from MagSim import SimMode, ParallelSim, update_objects, calc_forces, calc_forces_bh
+from graphVizUI import GraphUIObject, Plotter
+from generators import gnm
+from typing import List
+import numpy as np
+import scipy
+import argparse
+import tracemalloc
+import platform
+import pygame
+import json
+import time
+import os
+
+# Sizes above this are skipped for the full (dense) solvers, they take too long.
+FULL_SOLVER_MAX_SIZE = 2000
+# Sizes above this are skipped for the pure python simulation loop.
+LOOP_SIM_MAX_SIZE = 2000
+# Sizes above this are skipped for the exact numpy simulation kernel.
+EXACT_SIM_MAX_SIZE = 20000
+# Sizes above this are only benchmarked with sparse storage.
+DENSE_MAX_SIZE = 2000
+AVG_DEGREE = 6
+# Vertices added (then removed) per repeat of the mutation benchmark.
+MUTATION_OPS = 100
+# Size of the offscreen surface the drawing benchmark draws on.
+(DRAW_WIDTH, DRAW_HEIGHT) = (1280, 720)
+# A result this many times slower than the one it is compared to counts as a regression.
+REGRESSION_FACTOR = 1.2
+# Result fields that are measurements. The other fields say what was measured.
+MEASURED_FIELDS = {"seconds", "peak_bytes", "error", "speedup", "max_error"}
+
+# Returns a random undirected graph with size * avg_degree / 2 edges.
+def random_graph(size : int, avg_degree : float = AVG_DEGREE, sparse : bool = True,
+        seed : int = 0) -> Graph:
+    n_edges = min(int(size * avg_degree / 2), size * (size - 1) // 2)
+    return gnm(size, n_edges, seed = seed, sparse = sparse)
+
+# Returns the storages to benchmark graphs of the given size with.
+def storages(size : int) -> List[str]:
+    return ["sparse", "dense"] if size <= DENSE_MAX_SIZE else ["sparse"]
+
+# Returns the best time of a function over a number of repeats, in seconds.
+def time_best(func, repeats : int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Returns the peak memory allocated while running a function once, in bytes. Only
+# python and numpy allocations are traced, not SDL surfaces or other processes.
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    func()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+# Returns the best time and the peak memory of a function, as result fields. Memory is
+# measured in a separate run, since tracing slows everything down.
+def measure(func, repeats : int = 3) -> dict:
+    return {"seconds": time_best(func, repeats), "peak_bytes": peak_memory(func)}
+
+# Formats a measure result for printing.
+def format_measure(result : dict) -> str:
+    return f"{result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 2**20:9.1f} MiB"
+
+# Compares the general, symmetric and partial eigensolvers on random graph laplacians.
+def bench_eig_solvers(sizes : List[int], repeats : int = 3) -> List[dict]:
+    results = []
+    solvers = [("general", EigSolver.GENERAL), ("symmetric", EigSolver.SYMMETRIC),
+        ("partial", EigSolver.PARTIAL)]
+    for size in sizes:
+        laplacian = random_graph(size).get_laplacian()
+        for (name, solver) in solvers:
+            if solver != EigSolver.PARTIAL and size > FULL_SOLVER_MAX_SIZE: continue
+            m = measure(lambda: solve_eigs(laplacian, solver, EigMode.LAP, 2), repeats)
+            results.append({"bench": "eig_solvers", "size": size, "solver": name, **m})
+            print(f"eig  n={size:<8} {name:<10} {format_measure(m)}")
+    return results
+
+# Compares one step of the python and numpy magnetic simulation kernels.
+def bench_sim(sizes : List[int], repeats : int = 3) -> List[dict]:
+    results = []
+    modes = [("loop", SimMode.LOOP), ("vector", SimMode.VECTOR)]
+    for size in sizes:
+        rng = np.random.default_rng(size)
+        coords = rng.uniform(-1, 1, (size, 2))
+        degrees = rng.integers(0, 2 * AVG_DEGREE, size)
+        for (name, mode) in modes:
+            if mode == SimMode.LOOP and size > LOOP_SIM_MAX_SIZE: continue
+            objects = coords.tolist() if mode == SimMode.LOOP else coords
+            m = measure(lambda: update_objects(objects, degrees, mode), repeats)
+            results.append({"bench": "sim", "size": size, "mode": name, **m})
+            print(f"sim  n={size:<8} {name:<10} {format_measure(m)}")
+    return results
+
+# Compares the Barnes-Hut kernel to the exact one, for speed and relative error.
+def bench_barnes_hut(sizes : List[int], thetas : List[float], repeats : int = 3) -> List[dict]:
+    results = []
+    for size in sizes:
+        rng = np.random.default_rng(size)
+        coords = rng.standard_normal((size, 2))
+        degrees = rng.integers(0, 2 * AVG_DEGREE, size)
+        exact = None
+        if size <= EXACT_SIM_MAX_SIZE:
+            t = time_best(lambda: calc_forces(coords, degrees), repeats)
+            exact = calc_forces(coords, degrees)
+            results.append({"bench": "barnes_hut", "size": size, "theta": 0, "seconds": t,
+                "error": 0.0})
+            print(f"bh   n={size:<8} exact      {t * 1000:10.2f} ms")
+        for theta in thetas:
+            t = time_best(lambda: calc_forces_bh(coords, degrees, theta), repeats)
+            error = None
+            if exact is not None:
+                approx = calc_forces_bh(coords, degrees, theta)
+                error = float(np.linalg.norm(approx - exact) / np.linalg.norm(exact))
+            results.append({"bench": "barnes_hut", "size": size, "theta": theta, "seconds": t,
+                "error": error})
+            error_text = f"rel. error {error:.2e}" if error is not None else ""
+            print(f"bh   n={size:<8} theta={theta:<4} {t * 1000:10.2f} ms  {error_text}")
+    return results
+
+# Times the parallel simulation kernel with 1 to N worker processes, against the serial
+# numpy kernel.
+def bench_parallel(sizes : List[int], workers : List[int], repeats : int = 3) -> List[dict]:
+    results = []
+    for size in sizes:
+        rng = np.random.default_rng(size)
+        coords = rng.standard_normal((size, 2))
+        degrees = rng.integers(0, 2 * AVG_DEGREE, size)
+        serial = calc_forces(coords, degrees)
+        t_serial = time_best(lambda: calc_forces(coords, degrees), repeats)
+        print(f"par  n={size:<8} serial     {t_serial * 1000:10.2f} ms")
+        for n_workers in workers:
+            sim = ParallelSim(n_workers)
+            sim.calc_forces(coords, degrees)    # Start up the workers
+            t = time_best(lambda: sim.calc_forces(coords, degrees), repeats)
+            error = float(np.abs(sim.calc_forces(coords, degrees) - serial).max())
+            sim.close()
+            results.append({"bench": "parallel", "size": size, "workers": n_workers,
+                "seconds": t, "speedup": t_serial / t, "max_error": error})
+            print(f"par  n={size:<8} workers={n_workers:<3} {t * 1000:8.2f} ms  "
+                f"speedup {t_serial / t:5.2f}x  max error {error:.1e}")
+    return results
+
+# Times adding MUTATION_OPS vertices (each connected to avg_degree random vertices) and
+# removing them again, per vertex. Adding includes flushing the pending sparse edges.
+def bench_mutation(sizes : List[int], degrees : List[float], repeats : int = 3) -> List[dict]:
+    results = []
+    for size in sizes:
+        for degree in degrees:
+            for storage in storages(size):
+                graph = random_graph(size, degree, sparse = storage == "sparse")
+                rng = np.random.default_rng(size)
+                batch = rng.integers(0, size, (MUTATION_OPS, max(int(degree), 1))).tolist()
+                added = []
+
+                def add():
+                    added[:] = [graph.add_vertex(connections) for connections in batch]
+                    graph.adj_matrix
+                def remove():
+                    for vertex_id in added: graph.remove_vertex(vertex_id)
+                def add_remove():
+                    add()
+                    remove()
+
+                (t_add, t_remove) = (float("inf"), float("inf"))
+                for _ in range(repeats):
+                    t_add = min(t_add, time_best(add, 1))
+                    t_remove = min(t_remove, time_best(remove, 1))
+                peak = peak_memory(add_remove)
+                for (op, t) in (("add_vertex", t_add), ("remove_vertex", t_remove)):
+                    m = {"seconds": t / MUTATION_OPS, "peak_bytes": peak}
+                    results.append({"bench": "mutation", "size": size, "degree": degree,
+                        "storage": storage, "op": op, **m})
+                    print(f"mut  n={size:<8} d={degree:<5} {storage:<6} {op:<14} "
+                        f"{t / MUTATION_OPS * 1e6:10.2f} us {peak / 2**20:9.1f} MiB")
+    return results
+
+# Times get_coords and get_eig_vals (both modes) from scratch, by marking the graph as
+# changed before every call so the cached results aren't used.
+def bench_layout(sizes : List[int], degrees : List[float], repeats : int = 3) -> List[dict]:
+    results = []
+    for size in sizes:
+        for degree in degrees:
+            for storage in storages(size):
+                graph = random_graph(size, degree, sparse = storage == "sparse")
+                ops = [("get_coords", lambda: graph.get_coords()),
+                    ("eig_vals_adj", lambda: graph.get_eig_vals(EigMode.ADJ)),
+                    ("eig_vals_lap", lambda: graph.get_eig_vals(EigMode.LAP))]
+                for (op, func) in ops:
+                    def uncached():
+                        graph.mark_changed()
+                        func()
+                    m = measure(uncached, repeats)
+                    results.append({"bench": "layout", "size": size, "degree": degree,
+                        "storage": storage, "op": op, **m})
+                    print(f"lay  n={size:<8} d={degree:<5} {storage:<6} {op:<14} {format_measure(m)}")
+    return results
+
+# Times a full redraw of a GraphUIObject (with its layout already computed) and of a
+# Plotter with size points, on an offscreen surface. Uses the SDL dummy video driver
+# unless another one is set, so no window is needed.
+def bench_draw(sizes : List[int], degrees : List[float], repeats : int = 3) -> List[dict]:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    surface = pygame.Surface((DRAW_WIDTH, DRAW_HEIGHT))
+    results = []
+
+    def redraw(obj):
+        obj.changed = True
+        obj.draw(surface, 0, 0, DRAW_WIDTH, DRAW_HEIGHT)
+
+    for size in sizes:
+        for degree in degrees:
+            graph = random_graph(size, degree)
+            obj = GraphUIObject(0, 0, 1, 1, graph = graph)
+            redraw(obj)     # Computes the layout
+            n_edges = len(graph.get_edge_index()[0])
+            mode = "raster" if size + n_edges > obj.raster_threshold else "vector"
+            m = measure(lambda: redraw(obj), repeats)
+            results.append({"bench": "draw", "size": size, "degree": degree,
+                "widget": "graph", "mode": mode, **m})
+            print(f"draw n={size:<8} d={degree:<5} graph {mode:<8} {format_measure(m)}")
+
+        plotter = Plotter(0, 0, 1, 1, data = np.random.default_rng(size).standard_normal(size))
+        m = measure(lambda: redraw(plotter), repeats)
+        results.append({"bench": "draw", "size": size, "widget": "plotter", **m})
+        print(f"draw n={size:<8}         plotter        {format_measure(m)}")
+    return results
+
+# Returns what a result measured, to match it with results of other runs.
+def result_key(result : dict) -> tuple:
+    return tuple(sorted((k, v) for (k, v) in result.items() if k not in MEASURED_FIELDS))
+
+# Prints how the results compare to the ones saved in an earlier run, and returns the
+# number of regressions (at least REGRESSION_FACTOR times slower).
+def compare_results(results : List[dict], path : str) -> int:
+    try:
+        with open(path) as file: old = json.load(file)["results"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"ERROR: could not read results from {path}: {e}")
+        return 0
+    old = {result_key(result): result for result in old}
+    regressions = 0
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None or not before.get("seconds"): continue
+        ratio = result["seconds"] / before["seconds"]
+        if ratio >= REGRESSION_FACTOR:
+            regressions += 1
+            fields = ", ".join(f"{k}={v}" for (k, v) in result_key(result))
+            print(f"REGRESSION: {fields} is {ratio:.2f}x slower "
+                f"({before['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms)")
+    print(f"{regressions} regressions compared to {path}.")
+    return regressions
+
+# Writes the results to a JSON file, along with what they were measured on.
+def save_results(results : List[dict], path : str, args : argparse.Namespace) -> None:
+    info = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args),
+        "python": platform.python_version(), "numpy": np.__version__,
+        "scipy": scipy.__version__, "pygame": pygame.version.ver,
+        "platform": platform.platform(), "cpus": os.cpu_count()}
+    with open(path, "w") as file:
+        json.dump({"info": info, "results": results}, file, indent = 1)
+    print(f"Wrote {len(results)} results to {path}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks for GraphViz hot paths.")
+    parser.add_argument("bench", choices = ["eig", "sim", "bh", "parallel", "mutation", "layout",
+        "draw", "all"], help = "Which benchmark to run (all runs mutation, layout, sim and draw).")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [100, 500, 1000, 2000, 10000, 50000])
+    parser.add_argument("--degrees", type = float, nargs = "+", default = [2, AVG_DEGREE, 20],
+        help = "Average vertex degrees of the random graphs, for the mutation, layout and draw benchmarks.")
+    parser.add_argument("--repeats", type = int, default = 3)
+    parser.add_argument("--thetas", type = float, nargs = "+", default = [0.3, 0.5, 0.8],
+        help = "Opening angles for the Barnes-Hut benchmark.")
+    parser.add_argument("--workers", type = int, nargs = "+", default = None,
+        help = "Worker counts for the parallel benchmark (default: powers of 2 up to the CPU count).")
+    parser.add_argument("--output", default = None,
+        help = "JSON file to write the results to (default: bench-<bench>-<date>.json).")
+    parser.add_argument("--compare", default = None,
+        help = "JSON results of an earlier run, to report regressions against.")
+    args = parser.parse_args()
+
+    match args.bench:
+        case "eig":
+            results = bench_eig_solvers(args.sizes, args.repeats)
+        case "sim":
+            results = bench_sim(args.sizes, args.repeats)
+        case "bh":
+            results = bench_barnes_hut(args.sizes, args.thetas, args.repeats)
+        case "parallel":
+            workers = args.workers
+            if workers is None:
+                workers = [1 << i for i in range(os.cpu_count().bit_length())]
+            results = bench_parallel(args.sizes, workers, args.repeats)
+        case "mutation":
+            results = bench_mutation(args.sizes, args.degrees, args.repeats)
+        case "layout":
+            results = bench_layout(args.sizes, args.degrees, args.repeats)
+        case "draw":
+            results = bench_draw(args.sizes, args.degrees, args.repeats)
+        case "all":
+            results = (bench_mutation(args.sizes, args.degrees, args.repeats)
+                + bench_layout(args.sizes, args.degrees, args.repeats)
+                + bench_sim(args.sizes, args.repeats)
+                + bench_draw(args.sizes, args.degrees, args.repeats))
+
+    output = args.output
+    if output is None: output = f"bench-{args.bench}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    save_results(results, output, args)
+    if args.compare is not None: compare_results(results, args.compare)
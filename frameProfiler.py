@@ -0,0 +1,127 @@
+from typing import List, Dict
+from collections import deque, defaultdict
+import numpy as np
+import threading
+import json
+import time
+import os
+
+HISTORY_FRAMES = 240            # Frames kept for the rolling percentiles.
+MAX_TRACE_EVENTS = 200000       # Trace events kept for export, oldest are dropped first.
+PERCENTILES = [50, 90, 99]
+
+# Times a block of code (with a with statement) if the profiler is enabled.
+class Span:
+    def __init__(self, profiler : "FrameProfiler", name : str, category : str) -> None:
+        self.profiler : FrameProfiler = profiler
+        self.name : str = name
+        self.category : str = category
+        self.start : float = None
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter() if self.profiler.enabled else None
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.start is not None:
+            self.profiler.add_span(self.name, self.category, self.start, time.perf_counter())
+
+# Collects per frame metrics: time spent in named spans (in ms, summed per frame) and
+# counters, keeping the last HISTORY_FRAMES frames for rolling percentiles. Spans are
+# also kept as trace events, which export_trace writes in the Chrome trace event format
+# (loads in chrome://tracing and Perfetto). Does nothing until enabled.
+# Spans can end on any thread (e.g. the layout worker), and count towards the frame
+# that is open when they do.
+class FrameProfiler:
+    def __init__(self, history : int = HISTORY_FRAMES, max_events : int = MAX_TRACE_EVENTS) -> None:
+        self.enabled : bool = False
+        # Metrics of the frames so far, oldest first. Each maps metric name to value.
+        self.history : deque = deque(maxlen = history)
+        self.events : deque = deque(maxlen = max_events)
+        self.frame : defaultdict = defaultdict(float)    # Metrics of the current frame
+        self.frame_start : float = None
+        self.thread_names : Dict[int, str] = {}
+        self.lock : threading.Lock = threading.Lock()
+        self.start_time : float = time.perf_counter()
+
+    def enable(self, enabled : bool = True) -> None:
+        self.enabled = enabled
+        if not enabled: self.frame_start = None
+
+    def span(self, name : str, category : str) -> Span:
+        return Span(self, name, category)
+
+    # Records a span from start to end (perf_counter seconds).
+    def add_span(self, name : str, category : str, start : float, end : float) -> None:
+        thread = threading.current_thread()
+        with self.lock:
+            self.frame[f"{category} {name}"] += (end - start) * 1000
+            self.thread_names[thread.native_id] = thread.name
+            self.events.append({"name": name, "cat": category, "ph": "X",
+                "ts": self.trace_time(start), "dur": (end - start) * 1e6,
+                "pid": os.getpid(), "tid": thread.native_id})
+
+    # Adds n to a counter of the current frame.
+    def count(self, name : str, n : int = 1) -> None:
+        if not self.enabled: return
+        with self.lock: self.frame[name] += n
+
+    # Starts timing a frame, unless one is already open.
+    def begin_frame(self) -> None:
+        if self.enabled and self.frame_start is None: self.frame_start = time.perf_counter()
+
+    # Closes the open frame and adds its metrics to the history.
+    def end_frame(self) -> None:
+        if not self.enabled or self.frame_start is None: return
+        end = time.perf_counter()
+        with self.lock:
+            (frame, self.frame) = (self.frame, defaultdict(float))
+        frame["frame"] = (end - self.frame_start) * 1000
+        self.history.append(frame)
+        counters = {name: value for (name, value) in frame.items() if " " not in name}
+        with self.lock:
+            self.events.append({"name": "frame", "cat": "frame", "ph": "X",
+                "ts": self.trace_time(self.frame_start), "dur": (end - self.frame_start) * 1e6,
+                "pid": os.getpid(), "tid": threading.main_thread().native_id})
+            self.events.append({"name": "counters", "ph": "C", "ts": self.trace_time(end),
+                "pid": os.getpid(), "args": counters})
+        self.frame_start = None
+
+    # Microseconds since the profiler was created.
+    def trace_time(self, t : float) -> float:
+        return (t - self.start_time) * 1e6
+
+    # Names of all metrics in the history, frame time first, then timings, then counters.
+    def metrics(self) -> List[str]:
+        names = set()
+        for frame in self.history: names.update(frame.keys())
+        names.discard("frame")
+        return ["frame"] + sorted(names, key = lambda name: (" " not in name, name))
+
+    # Returns the percentiles of a metric over the history. Frames where it was never
+    # recorded count as 0.
+    def percentiles(self, name : str, percentiles : List[float] = PERCENTILES) -> np.array:
+        if len(self.history) == 0: return np.zeros(len(percentiles))
+        values = np.array([frame.get(name, 0) for frame in self.history])
+        return np.percentile(values, percentiles)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.history.clear()
+            self.events.clear()
+            self.frame = defaultdict(float)
+        self.frame_start = None
+
+    # Writes the recorded events to a Chrome trace event JSON file.
+    def export_trace(self, path : str) -> None:
+        with self.lock:
+            events = list(self.events)
+            names = dict(self.thread_names)
+        events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+            "args": {"name": name}} for (tid, name) in names.items()]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        print(f"Wrote {len(events)} trace events to {path}.")
+
+# Shared by everything that is profiled.
+frame_profiler : FrameProfiler = FrameProfiler()
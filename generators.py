@@ -0,0 +1,153 @@
+from graph import Graph
+from typing import List
+import numpy as np
+
+# Random (and not so random) graph generators. Everything is vectorized, builds the
+# graph straight from edge lists (sparse unless sparse = False), and takes a seed so
+# results can be reproduced.
+
+# Rounds of re-pairing random_regular does to get rid of self loops and multi-edges.
+REGULAR_MAX_ROUNDS = 100
+
+# Returns the (row, col) with row < col of the k-th pair, counting pairs row by row.
+def pair_from_index(k : np.array, n : int):
+    k = np.asarray(k, dtype = np.int64)
+    total = n * (n - 1) // 2
+    # There are m (m - 1) / 2 pairs from row n - m onwards, so the row is n - m for the
+    # smallest m with at least total - k of them.
+    rest = total - k
+    m = np.ceil((1 + np.sqrt(1 + 8 * rest.astype(np.float64))) / 2).astype(np.int64)
+    # Fix any rounding error in the square root.
+    m += m * (m - 1) // 2 < rest
+    m -= (m - 1) * (m - 2) // 2 >= rest
+    rows = n - m
+    cols = rows + 1 + k - (total - m * (m - 1) // 2)
+    return (rows, cols)
+
+# Erdős–Rényi G(n, p): every pair is an edge with probability p. Only the edges are
+# generated, by jumping over the pairs that aren't with geometric gaps, so this takes
+# O(n + m) instead of O(n^2).
+def gnp(n : int, p : float, seed : int = None, sparse : bool = True) -> Graph:
+    if p < 0 or p > 1:
+        print(f"ERROR: p must be between 0 and 1, not {p}.")
+        return None
+    rng = np.random.default_rng(seed)
+    total = n * (n - 1) // 2
+    chunks = []
+    last = -1
+    while p > 0 and last < total:
+        # A few more than expected, so this is usually one round.
+        batch = int((total - last) * p + 5 * np.sqrt((total - last) * p) + 16)
+        indices = last + np.cumsum(rng.geometric(p, batch))
+        chunks.append(indices[indices < total])
+        last = int(indices[-1])
+    indices = np.concatenate(chunks) if len(chunks) else np.zeros(0, dtype = np.int64)
+    (rows, cols) = pair_from_index(indices, n)
+    return Graph.from_edges(rows, cols, n, sparse = sparse)
+
+# Erdős–Rényi G(n, m): m edges, picked uniformly from all pairs.
+def gnm(n : int, m : int, seed : int = None, sparse : bool = True) -> Graph:
+    total = n * (n - 1) // 2
+    if m > total:
+        print(f"ERROR: a graph with {n} vertices has at most {total} edges, not {m}.")
+        return None
+    rng = np.random.default_rng(seed)
+    indices = np.zeros(0, dtype = np.int64)
+    # Draws with replacement and drops duplicates until there are enough.
+    while len(indices) < m:
+        indices = np.sort(np.concatenate([indices, rng.integers(0, total, m - len(indices))]))
+        indices = indices[np.concatenate([[True], indices[1:] != indices[:-1]])]
+    (rows, cols) = pair_from_index(indices, n)
+    return Graph.from_edges(rows, cols, n, sparse = sparse)
+
+# Random d-regular graph, from the configuration model: every vertex gets d stubs, which
+# are paired up at random. Pairs that make self loops or multi-edges are shuffled again
+# (together with as many random good pairs), and dropped if that doesn't work out.
+# Dense graphs are made as the complement of a sparse one.
+def random_regular(n : int, d : int, seed : int = None, sparse : bool = True) -> Graph:
+    if (n * d) % 2 or d >= n:
+        print(f"ERROR: there is no {d}-regular graph with {n} vertices.")
+        return None
+    if 2 * d > n - 1:
+        # Dense: pairing rarely works out, but the complement is a sparse regular graph.
+        complement = random_regular(n, n - 1 - d, seed = seed, sparse = False).adj_matrix
+        adj = np.ones((n, n), dtype = np.int64) - np.eye(n, dtype = np.int64) - complement
+        return Graph.from_edges(*np.nonzero(np.triu(adj)), n, sparse = sparse)
+    rng = np.random.default_rng(seed)
+    stubs = rng.permutation(np.repeat(np.arange(n, dtype = np.int64), d)).reshape(-1, 2)
+
+    for _ in range(REGULAR_MAX_ROUNDS):
+        bad = find_bad_pairs(stubs, n)
+        if len(bad) == 0: break
+        is_good = np.ones(len(stubs), dtype = bool)
+        is_good[bad] = False
+        good = np.flatnonzero(is_good)
+        redo = np.concatenate([bad, rng.choice(good, min(len(bad), len(good)), replace = False)])
+        stubs[redo] = rng.permutation(stubs[redo].ravel()).reshape(-1, 2)
+    bad = find_bad_pairs(stubs, n)
+    if len(bad):
+        print(f"WARNING: dropped {len(bad)} edges, the graph is only roughly {d}-regular.")
+        stubs = np.delete(stubs, bad, axis = 0)
+    return Graph.from_edges(stubs[:, 0], stubs[:, 1], n, sparse = sparse)
+
+# Returns the indices of the pairs that are self loops or repeat another pair (all but
+# one of each repeated pair).
+def find_bad_pairs(pairs : np.array, n : int) -> np.array:
+    low = np.minimum(pairs[:, 0], pairs[:, 1])
+    high = np.maximum(pairs[:, 0], pairs[:, 1])
+    keys = low * n + high
+    order = np.argsort(keys)
+    repeated = np.zeros(len(pairs), dtype = bool)
+    repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+    return np.flatnonzero(repeated | (low == high))
+
+# Grid graph with the given size along each dimension: every vertex is connected to its
+# neighbours along each axis (wrapping around if periodic). Vertex IDs count along the
+# last dimension first.
+def grid(dims : List[int], periodic : bool = False, sparse : bool = True) -> Graph:
+    dims = [int(d) for d in dims]
+    n = int(np.prod(dims))
+    ids = np.arange(n, dtype = np.int64).reshape(dims)
+    (rows, cols) = ([], [])
+    for axis in range(len(dims)):
+        if dims[axis] < 2: continue
+        if periodic and dims[axis] > 2:
+            neighbours = np.roll(ids, -1, axis = axis)
+            rows.append(ids.ravel())
+            cols.append(neighbours.ravel())
+        else:
+            rows.append(np.delete(ids, -1, axis = axis).ravel())
+            cols.append(np.delete(ids, 0, axis = axis).ravel())
+    rows = np.concatenate(rows) if len(rows) else np.zeros(0, dtype = np.int64)
+    cols = np.concatenate(cols) if len(cols) else np.zeros(0, dtype = np.int64)
+    return Graph.from_edges(rows, cols, n, sparse = sparse)
+
+# d-dimensional hypercube: 2^d vertices, connected if their IDs differ in one bit.
+# hypercube(3) is the cube.
+def hypercube(d : int, sparse : bool = True) -> Graph:
+    return grid([2] * d, sparse = sparse)
+
+# Barabási–Albert preferential attachment: vertices are added one by one, each with m
+# edges to earlier vertices picked with probability proportional to their degree.
+# Uses the Batagelj–Brandes trick: the k-th edge's target is the endpoint of a uniformly
+# random earlier edge slot, so all edges can be drawn at once and then resolved by
+# following the slots back. Repeated edges are merged, and the self loops of the first
+# vertex are dropped, so a few vertices end up with slightly fewer than m edges.
+def preferential_attachment(n : int, m : int, seed : int = None, sparse : bool = True) -> Graph:
+    if m < 1:
+        print(f"ERROR: every new vertex needs at least one edge, not {m}.")
+        return None
+    rng = np.random.default_rng(seed)
+    n_edges = n * m
+    sources = np.arange(n_edges, dtype = np.int64) // m
+    # Slots 2k and 2k + 1 are the source and target of edge k. The target copies a
+    # random slot before it.
+    slots = np.floor(rng.random(n_edges) * (2 * np.arange(n_edges) + 1)).astype(np.int64)
+    # Odd slots are targets, which copy another slot in turn.
+    unresolved = np.flatnonzero(slots % 2 == 1)
+    while len(unresolved):
+        slots[unresolved] = slots[(slots[unresolved] - 1) // 2]
+        unresolved = unresolved[slots[unresolved] % 2 == 1]
+    targets = sources[slots // 2]
+    keep = sources != targets
+    return Graph.from_edges(sources[keep], targets[keep], n, sparse = sparse)
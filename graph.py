@@ -1,124 +1,572 @@
+from frameProfiler import frame_profiler
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import lobpcg, eigsh, eigs
 from typing import List, Tuple
 import math
+import itertools
+import warnings
 
-ROUND_DIGITS = 2
+# Eigenvalues at most this times the largest one (in magnitude, or 1 if that is smaller)
+# count as zero. Rounding to a fixed number of digits instead would also drop the real
+# (but tiny) Fiedler values of big meshes and grids.
+ZERO_EIG_TOL = 1e-8
+
+# Graphs with at most this many vertices get a full (dense) decomposition. Bigger ones
+# only get the few eigenpairs they need from an iterative solver, which is slower (and
+# less reliable) than LAPACK on small matrices.
+PARTIAL_SOLVER_LIMIT = 2000
+SPARSE_EIG_TOL = 1e-4
+SPARSE_EIG_MAXITER = 500
+# Max number of connected components to project out of the sparse solver. Graphs with
+# more components than this fall back to shift-invert.
+MAX_CONSTRAINED_COMPONENTS = 16
+SHIFT_INVERT_SIGMA = -1e-3
+# Number of eigenvalues in the spectrum of a big graph.
+SPARSE_SPECTRUM_K = 20
+
+# Incremental layouts only refine the previous one if at most this fraction of the
+# vertices were added or removed, and the graph has at least INCREMENTAL_MIN_SIZE
+# vertices (small graphs are faster to just solve).
+INCREMENTAL_MAX_CHANGE = 0.05
+INCREMENTAL_MIN_SIZE = 50
+INCREMENTAL_MAX_ITERS = 20
 
 # Enum for method of getting eigenvaluess from graph
 class EigMode:
     ADJ = 0     # Adjacency Matrix
     LAP = 1     # Laplacian (of adjacency matrix)
 
+# Enum for which eigensolver to use
+class EigSolver:
+    AUTO = 0        # Pick one of the below based on the matrix
+    GENERAL = 1     # np.linalg.eig, needed for directed (asymmetric) graphs
+    SYMMETRIC = 2   # np.linalg.eigh, full decomposition of a symmetric matrix
+    PARTIAL = 3     # Only the smallest laplacian (or largest adjacency) eigenpairs
+
+# The adjacency matrix can be stored either as a dense numpy array or as a scipy CSR
+# matrix. By default, a graph is sparse if the matrix passed in is sparse.
+# Dense graphs keep their matrix in a bigger square buffer whose capacity doubles when
+# it is full, so adding vertices doesn't copy the whole matrix every time. Sparse
+# graphs queue up added edges and only rebuild their CSR matrix when adj_matrix is
+# next used.
+# Every vertex gets an ID that never changes. Each vertex lives in a slot (a row of the
+# buffer), and removed vertices just leave a dead slot behind. Dead slots are cleaned
+# up together the next time adj_matrix is used (or the buffer has to grow), so removing
+# vertices doesn't copy the matrix. adj_matrix, get_coords, etc. only have rows for
+# alive vertices, in order of ID: use vertex_ids and index_of to convert between the two.
 class Graph:
-    def __init__(self, adj_matrix : np.array = np.empty([0, 0])) -> None:
-        self.adj_matrix : np.array = adj_matrix
-        self.size : int = self.adj_matrix.size
+    MIN_CAPACITY : int = 16
+
+    def __init__(self, adj_matrix : np.array = np.empty([0, 0]), sparse : bool = None) -> None:
+        if sparse is None: sparse = sp.issparse(adj_matrix)
+        self.sparse : bool = sparse
 
         self.changed : bool = True  # For UI
 
-    # Adds a new vertex to the graph. Connections is a list of vertex indices
-    # that it is connected to. For example, if the vertex we are adding is connected to
+        # Incremented on every change, so that cached results know when they are stale.
+        self.version : int = 0
+        # Cached decompositions. Maps EigMode to (version, eigenvalues, eigenvectors, k),
+        # where k is the number of non-zero eigenpairs computed (math.inf if all were).
+        self.eig_cache : dict = {}
+        self.eig_solver : int = EigSolver.AUTO
+
+        # If true, get_coords refines the previous layout with a few warm-started
+        # iterations after small edits, and keeps it aligned with the previous one.
+        self.incremental : bool = False
+        # Vertices added and removed since the last layout (incremental only), as a
+        # list of (added ids, removed ids).
+        self.deltas : List[Tuple[np.array, np.array]] = []
+        # Last layout, as (version, vertex ids, coords).
+        self.layout_cache : Tuple[int, np.array, np.array] = (-1, None, None)
+        # Undirected edges, as (version, rows, cols).
+        self.edge_cache : Tuple[int, np.array, np.array] = (-1, None, None)
+
+        # Edges added to a sparse graph since its CSR matrix was built, as (rows, cols).
+        self.pending_edges : List[Tuple[np.array, np.array]] = []
+        self.adj_matrix = adj_matrix
+
+    # Adjacency matrix of the alive vertices, a view into the buffer. Compacts the dead
+    # slots first, which costs about as much as copying out the alive rows would, but
+    # only has to be done once after any number of removals.
+    @property
+    def adj_matrix(self):
+        if self.dead: self.compact()
+        if self.sparse:
+            if self.pending_edges or self.sparse_adj.shape[0] != self.slots:
+                self.flush_edges()
+            return self.sparse_adj
+        return self.buffer[:self.slots, :self.slots]
+
+    @adj_matrix.setter
+    def adj_matrix(self, adj_matrix) -> None:
+        if self.sparse:
+            self.sparse_adj = sp.csr_array(adj_matrix, dtype = np.int64)
+            self.pending_edges = []
+        else:
+            if sp.issparse(adj_matrix): adj_matrix = adj_matrix.toarray()
+            # Edits and compact() work in place, so the caller's array is copied. Copy on
+            # write memmaps (from graphIO.load_snapshot) are already private.
+            elif not (isinstance(adj_matrix, np.memmap) and adj_matrix.mode == "c"):
+                adj_matrix = np.array(adj_matrix, dtype = np.int64)
+            if adj_matrix.size == 0: adj_matrix = np.zeros(adj_matrix.shape, dtype = np.int64)
+            self.buffer : np.array = adj_matrix
+        self.size : int = adj_matrix.shape[0]       # Number of alive vertices
+        self.slots : int = self.size                # Number of used slots, alive or dead
+        self.dead : int = 0
+        self.alive : np.array = np.ones(self.size, dtype = bool)
+        # ID of the vertex in each slot. Always increasing, since new vertices go at the end.
+        self.slot_ids : np.array = np.arange(self.size, dtype = np.int64)
+        self.next_id : int = self.size
+
+    # Call after changing the graph (add_vertex and remove_vertex do this already). If you
+    # edit adj_matrix directly, you have to call this yourself.
+    def mark_changed(self) -> None:
+        self.version += 1
+        self.changed = True
+
+    # Creates a graph from lists of edge endpoints, without ever building a dense matrix
+    # (unless sparse is False). Edges are undirected unless directed is True.
+    @classmethod
+    def from_edges(cls, rows : np.array, cols : np.array, size : int = None,
+            directed : bool = False, sparse : bool = True) -> "Graph":
+        rows = np.asarray(rows, dtype = np.int64)
+        cols = np.asarray(cols, dtype = np.int64)
+        if size is None: size = int(max(rows.max(initial = -1), cols.max(initial = -1))) + 1
+        if not directed:
+            (rows, cols) = (np.concatenate((rows, cols)), np.concatenate((cols, rows)))
+        adj = sp.csr_array((np.ones(rows.size, dtype = np.int64), (rows, cols)),
+            shape = (size, size))
+        # Duplicate edges are summed by scipy, clamp them back to 1.
+        adj.data[:] = 1
+        return cls(adj, sparse = sparse)
+
+    # Returns a copy of the graph (without dead slots) with the same vertex IDs and
+    # version, for computing its layout somewhere else. The queued incremental deltas
+    # are handed over to the copy (or copied, if take_deltas is False, for snapshots
+    # that won't be laid out incrementally), and results already cached for this
+    # version are shared.
+    def snapshot(self, take_deltas : bool = True) -> "Graph":
+        # The setter already copies dense matrices.
+        adj = self.adj_matrix.copy() if self.sparse else self.adj_matrix
+        copy = Graph(adj, sparse = self.sparse)
+        copy.slot_ids[:] = self.vertex_ids()
+        copy.next_id = self.next_id
+        copy.version = self.version
+        copy.eig_solver = self.eig_solver
+        copy.incremental = self.incremental
+        copy.eig_cache = {mode: cached for (mode, cached) in self.eig_cache.items()
+            if cached[0] == self.version}
+        if self.layout_cache[0] == self.version: copy.layout_cache = self.layout_cache
+        if take_deltas: (copy.deltas, self.deltas) = (self.deltas, [])
+        else: copy.deltas = list(self.deltas)
+        return copy
+
+    # Returns the IDs of the alive vertices, in the same order as the matrix rows.
+    def vertex_ids(self) -> np.array:
+        if self.dead == 0: return self.slot_ids[:self.slots]
+        return self.slot_ids[:self.slots][self.alive[:self.slots]]
+
+    # Returns the matrix row of each vertex ID (or -1 if it doesn't exist).
+    def index_of(self, vertex_ids : np.array) -> np.array:
+        ids = self.vertex_ids()
+        vertex_ids = np.asarray(vertex_ids, dtype = np.int64)
+        indices = np.searchsorted(ids, vertex_ids)
+        found = indices < ids.size
+        found[found] = ids[indices[found]] == vertex_ids[found]
+        return np.where(found, indices, -1)
+
+    # Returns the slot of each vertex ID (or -1 if it doesn't exist or was removed).
+    def slot_of(self, vertex_ids : np.array) -> np.array:
+        used = self.slot_ids[:self.slots]
+        vertex_ids = np.asarray(vertex_ids, dtype = np.int64)
+        slots = np.searchsorted(used, vertex_ids)
+        found = slots < used.size
+        found[found] = (used[slots[found]] == vertex_ids[found]) & self.alive[slots[found]]
+        return np.where(found, slots, -1)
+
+    # Makes sure the graph can hold at least capacity slots without reallocating.
+    def reserve(self, capacity : int) -> None:
+        if capacity <= self.alive.size: return
+        alive = np.zeros(capacity, dtype = bool)
+        alive[:self.slots] = self.alive[:self.slots]
+        slot_ids = np.zeros(capacity, dtype = np.int64)
+        slot_ids[:self.slots] = self.slot_ids[:self.slots]
+        (self.alive, self.slot_ids) = (alive, slot_ids)
+        if self.sparse: return
+
+        new_buffer = np.zeros((capacity, capacity), dtype = self.buffer.dtype)
+        new_buffer[:self.slots, :self.slots] = self.buffer[:self.slots, :self.slots]
+        self.buffer = new_buffer
+
+    # Builds a sparse graph's CSR matrix from the queued edges.
+    def flush_edges(self) -> None:
+        adj = self.sparse_adj
+        adj.resize((self.slots, self.slots))
+        if self.pending_edges:
+            rows = np.concatenate([r for (r, _) in self.pending_edges])
+            cols = np.concatenate([c for (_, c) in self.pending_edges])
+            new_edges = sp.csr_array((np.ones(rows.size, dtype = np.int64), (rows, cols)),
+                shape = (self.slots, self.slots))
+            new_edges.data[:] = 1
+            adj = adj.maximum(new_edges).tocsr()
+        self.sparse_adj = adj
+        self.pending_edges = []
+
+    # Adds a new vertex to the graph and returns its ID. Connections is a list of vertex
+    # IDs that it is connected to. For example, if the vertex we are adding is connected to
     # vertices 2, 3, and 5, the list should be [2, 3, 5], not [0, 0, 1, 1, 0, 1].
     # TODO: Should it be done this way? Option for either? 
-    def add_vertex(self, connections : List[int] = [], connected_to_self : bool = False) -> None:
-        # Shortcut if we are adding the first value
-        # TODO: Dont know if this is the best way to go about doing this.
-        if self.size == 0:
-            self.adj_matrix = np.array([[connected_to_self]], dtype = np.int64)
-            self.size += 1
-            return
-
-        # Generate edge connections
-        adj_vals = np.zeros((self.size, 1), dtype = np.int64)
-        for c in connections:
-            if c > self.size:
-                print(f"ERROR: could not add connection to vertex {c}: Out of bounds.")
-            else: adj_vals[c][0] = 1
-        
-        # Add column to adj matrix
-        self.adj_matrix = np.append(self.adj_matrix, adj_vals, 1)
-
-        # Append connected to self value, then transpose
-        adj_vals = np.append(adj_vals, [connected_to_self])
-        adj_vals = np.transpose(adj_vals)
-
-        # Add row to adj matrix
-        self.adj_matrix = np.vstack((self.adj_matrix, adj_vals.flatten()))
-
-        self.size += 1
-        self.changed = True
+    def add_vertex(self, connections : List[int] = [], connected_to_self : bool = False) -> int:
+        return self.add_vertices([connections], connected_to_self)[0]
+
+    # Adds a new vertex for each list of connections in batch, growing the matrix at most
+    # once, and returns their IDs. Connections can also be to vertices added earlier in
+    # the same batch.
+    def add_vertices(self, batch : List[List[int]],
+            connected_to_self : bool = False) -> np.array:
+        # Dead slots are reused before growing, which would copy everything anyway.
+        if self.slots + len(batch) > self.alive.size and self.dead: self.compact()
+        new_slots = self.slots + len(batch)
+        if new_slots > self.alive.size:
+            self.reserve(max(new_slots, self.alive.size * 2, self.MIN_CAPACITY))
+        new_vertices = np.arange(self.slots, new_slots)
+        new_ids = np.arange(self.next_id, self.next_id + len(batch))
+        self.alive[self.slots:new_slots] = True
+        self.slot_ids[self.slots:new_slots] = new_ids
+        (self.slots, self.next_id) = (new_slots, self.next_id + len(batch))
+
+        lengths = [len(c) for c in batch]
+        rows = np.repeat(new_vertices, lengths)
+        connections = np.fromiter(itertools.chain.from_iterable(batch), dtype = np.int64,
+            count = sum(lengths))
+        cols = self.slot_of(connections)
+        for c in connections[cols < 0]:
+            print(f"ERROR: could not add connection to vertex {c}: Out of bounds.")
+        (rows, cols) = (rows[cols >= 0], cols[cols >= 0])
+        if connected_to_self:
+            (rows, cols) = (np.concatenate((rows, new_vertices)), np.concatenate((cols, new_vertices)))
+
+        if self.sparse:
+            self.pending_edges.append((np.concatenate((rows, cols)), np.concatenate((cols, rows))))
+        else:
+            self.buffer[rows, cols] = 1
+            self.buffer[cols, rows] = 1
+
+        self.size += len(batch)
+        if self.incremental: self.deltas.append((new_ids, np.empty(0, dtype = np.int64)))
+        self.mark_changed()
+        return new_ids
     
-    # Removes a vertex from the graph. CAREFUL: if you are keeping track of certain vertex
-    # indexes, this will reduce all indexes that are greater than the one provided by one.
-    def remove_vertex(self, vertex_index : int) -> None:
-        if vertex_index >= self.size:
-            print(f"ERROR: could not remove vertex {vertex_index}: Out of bounds.")
-            return
-        self.adj_matrix = np.delete(self.adj_matrix, vertex_index, 0)
-        self.adj_matrix = np.delete(self.adj_matrix, vertex_index, 1)
-        self.size -= 1
-        self.changed = True
+    # Removes a vertex from the graph. IDs of the other vertices stay the same, but
+    # their matrix rows after the removed vertex move up by one.
+    def remove_vertex(self, vertex_id : int) -> None:
+        self.remove_vertices([vertex_id])
+
+    # Removes all of the vertices with the given IDs. Their slots are only marked as dead,
+    # and cleaned up by compact the next time adj_matrix is used.
+    def remove_vertices(self, vertex_ids : List[int]) -> None:
+        vertex_ids = np.unique(np.asarray(vertex_ids, dtype = np.int64))
+        slots = self.slot_of(vertex_ids)
+        for v in vertex_ids[slots < 0]:
+            print(f"ERROR: could not remove vertex {v}: Out of bounds.")
+        slots_found = slots >= 0
+        slots = slots[slots_found]
+        if slots.size == 0: return
+
+        self.alive[slots] = False
+        self.dead += slots.size
+        self.size -= slots.size
+        if self.incremental: self.deltas.append((np.empty(0, dtype = np.int64), vertex_ids[slots_found]))
+        self.mark_changed()
+
+    # Gets rid of dead slots by moving the alive ones down. IDs don't change.
+    def compact(self) -> None:
+        if self.dead == 0: return
+        alive = np.flatnonzero(self.alive[:self.slots])
+        if self.sparse:
+            if self.pending_edges or self.sparse_adj.shape[0] != self.slots:
+                self.flush_edges()
+            self.sparse_adj = self.sparse_adj[alive][:, alive]
+        else:
+            self.buffer[:self.size, :self.size] = self.buffer[np.ix_(alive, alive)]
+            self.buffer[self.size:self.slots, :self.slots] = 0
+            self.buffer[:self.slots, self.size:self.slots] = 0
+        self.slot_ids[:self.size] = self.slot_ids[alive]
+        self.alive[:self.slots] = False
+        self.alive[:self.size] = True
+        (self.slots, self.dead) = (self.size, 0)
 
     # Returns list of 1s and 0s. A 1 represents a connection or edge between the
     # vertex given and the index of the 1, and a 0 represents no connection.
     def get_connections(self, vertex_index : int) -> np.array:
+        if self.sparse: return self.adj_matrix[[vertex_index]].toarray()[0]
         return self.adj_matrix[vertex_index]
+
+    # Returns the laplacian (degree matrix - adjacency matrix), in the same storage as
+    # the adjacency matrix.
+    def get_laplacian(self):
+        return calc_laplacian(self.adj_matrix)
+
+    # Returns the adjacency matrix as a dense array. Careful with big sparse graphs.
+    def get_dense(self) -> np.array:
+        if self.sparse: return self.adj_matrix.toarray()
+        return self.adj_matrix
+
+    # Returns every edge once, as arrays of (rows, cols) with row < col, ignoring
+    # direction and self loops. Cached until the graph changes.
+    def get_edge_index(self) -> Tuple[np.array, np.array]:
+        (version, rows, cols) = self.edge_cache
+        if version == self.version: return (rows, cols)
+        adj = self.adj_matrix
+        if self.sparse:
+            (rows, cols) = sp.triu(adj + adj.T, k = 1).nonzero()
+        else:
+            (rows, cols) = np.nonzero(np.triu(adj + adj.T, k = 1))
+        self.edge_cache = (self.version, rows, cols)
+        return (rows, cols)
+
+    # Returns the degree of each vertex (column sums, like the laplacian uses).
+    def get_degrees(self) -> np.array:
+        return np.asarray(self.adj_matrix.sum(axis = 0)).ravel()
     
-    # Gets cartesian coordinates of each vertex using eigenvectors.
-    # Result is a list of two dimensional arrays (x, y) for each vertex.
-    def get_coords(self) -> np.array:
-        (x_coords_index, y_coords_index) =  find_smallest_eigs(self.adj_matrix)
-        return calc_graph_eig(self.adj_matrix, x_coords_index, y_coords_index)
+    # Returns (eigenvalues, eigenvectors) of the adjacency matrix or laplacian. Results
+    # are cached, so each graph version is only decomposed once per mode.
+    # Big graphs only get their k smallest non-zero laplacian eigenpairs, or their k
+    # largest magnitude adjacency eigenpairs (see solve_eigs).
+    def get_eigs(self, mode : int = EigMode.LAP,
+            k : int = SPARSE_SPECTRUM_K) -> Tuple[np.array, np.array]:
+        cached = self.eig_cache.get(mode)
+        if cached is not None and cached[0] == self.version and cached[3] >= k:
+            return (cached[1], cached[2])
 
-    # Gets eigenvalues of the graph's adjacency matrix.
-    def get_eig_vals(self, mode : int = EigMode.ADJ) -> List[float]:
         match mode:
-            case EigMode.ADJ:
-                return np.linalg.eig(self.adj_matrix).eigenvalues
-            case EigMode.LAP:
-                diag = np.diag(np.sum(self.adj_matrix, axis=0))
-                laplacian = np.subtract(diag, self.adj_matrix)
-                return np.linalg.eig(laplacian).eigenvalues
+            case EigMode.ADJ: matrix = self.adj_matrix
+            case EigMode.LAP: matrix = self.get_laplacian()
             case _:
                 print(f"ERROR: Invalid mode {mode}.")
-                return None
+                return (None, None)
+
+        solver = self.eig_solver
+        if solver == EigSolver.AUTO: solver = choose_solver(matrix)
+        with frame_profiler.span("get_eigs", "graph"):
+            (vals, vecs) = solve_eigs(matrix, solver, mode, k)
+        if len(vals) == self.size: k = math.inf
+
+        self.eig_cache[mode] = (self.version, vals, vecs, k)
+        return (vals, vecs)
+    
+    # Gets cartesian coordinates of each vertex using eigenvectors.
+    # Result is an array of (x, y) rows, one for each vertex.
+    def get_coords(self) -> np.array:
+        (version, prev_ids, prev_coords) = self.layout_cache
+        if version == self.version: return prev_coords
+
+        with frame_profiler.span("get_coords", "graph"):
+            n_changed = sum(a.size + r.size for (a, r) in self.deltas)
+            if (self.incremental and prev_coords is not None and self.size >= INCREMENTAL_MIN_SIZE
+                    and n_changed <= INCREMENTAL_MAX_CHANGE * self.size):
+                coords = self.refine_coords(prev_ids, prev_coords)
+            else:
+                (vals, vecs) = self.get_eigs(EigMode.LAP, 2)
+                if len(vals) < self.size:
+                    # Partial results already start at the smallest non-zero eigenvalue.
+                    coords = np.real(vecs[:, :2])
+                else:
+                    (x_coords_index, y_coords_index) = find_smallest_nonzero(vals)
+                    coords = np.real(vecs[:, [x_coords_index, y_coords_index]])
+            # Tiny graphs can have fewer than 2 non-zero eigenvalues, the rest stay at 0.
+            if coords.shape[1] < 2:
+                coords = np.hstack([coords, np.zeros((self.size, 2 - coords.shape[1]))])
+
+            ids = self.vertex_ids()
+            if self.incremental and prev_coords is not None:
+                coords = align_coords(coords, ids, prev_ids, prev_coords)
+        self.deltas = []
+        self.layout_cache = (self.version, ids.copy(), coords)
+        return coords
+
+    # Refines a previous layout for the current graph, with a few iterations of the
+    # sparse solver started from the old eigenvectors. New vertices start at the mean
+    # of their neighbours.
+    def refine_coords(self, prev_ids : np.array, prev_coords : np.array) -> np.array:
+        ids = self.vertex_ids()
+        rows = np.minimum(np.searchsorted(prev_ids, ids), prev_ids.size - 1)
+        found = prev_ids[rows] == ids
+
+        x0 = np.zeros((self.size, 2))
+        x0[found] = prev_coords[rows[found]]
+        adj = sp.csr_array(self.adj_matrix, dtype = np.float64)
+        if not found.all():
+            new = np.flatnonzero(~found)
+            neighbours = adj[new]
+            degrees = np.maximum(neighbours.sum(axis = 1), 1)
+            x0[new] = (neighbours @ x0) / degrees[:, None]
+
+        return sparse_smallest_eigs(calc_laplacian(adj), 2, x0 = x0,
+            maxiter = INCREMENTAL_MAX_ITERS)[1]
+
+    # Gets eigenvalues of the graph's adjacency matrix.
+    # See get_eigs for what is returned for big graphs.
+    def get_eig_vals(self, mode : int = EigMode.ADJ, k : int = SPARSE_SPECTRUM_K) -> List[float]:
+        return self.get_eigs(mode, k)[0]
     
 # _________________________________
 # ----- MATH HELPER FUNCTIONS -----
 # _________________________________
 
+# Returns the laplacian of a dense or sparse adjacency matrix.
+def calc_laplacian(adj_matrix):
+    if sp.issparse(adj_matrix):
+        degrees = np.asarray(adj_matrix.sum(axis=0)).ravel()
+        return (sp.diags_array(degrees, dtype = adj_matrix.dtype) - adj_matrix).tocsr()
+    diag = np.diag(np.sum(adj_matrix, axis=0))
+    return np.subtract(diag, adj_matrix)
+
+# Returns whether a dense or sparse matrix is equal to its transpose.
+def is_symmetric(matrix) -> bool:
+    if sp.issparse(matrix): return (matrix != matrix.T).nnz == 0
+    return np.array_equal(matrix, matrix.T)
+
+# Picks the fastest solver that works for the matrix.
+def choose_solver(matrix) -> int:
+    if not is_symmetric(matrix): return EigSolver.GENERAL
+    if matrix.shape[0] > PARTIAL_SOLVER_LIMIT: return EigSolver.PARTIAL
+    return EigSolver.SYMMETRIC
+
+# Returns (eigenvalues, eigenvectors) of a dense or sparse matrix using the given
+# EigSolver. SYMMETRIC returns them sorted in ascending order. PARTIAL only returns
+# part of the spectrum: for a laplacian, the k smallest non-zero eigenpairs, and for an
+# adjacency matrix, the k largest in magnitude. GENERAL also becomes partial in the
+# same way on big sparse matrices.
+def solve_eigs(matrix, solver : int, mode : int = EigMode.LAP,
+        k : int = SPARSE_SPECTRUM_K) -> Tuple[np.array, np.array]:
+    n = matrix.shape[0]
+    match solver:
+        case EigSolver.GENERAL:
+            if sp.issparse(matrix) and n > PARTIAL_SOLVER_LIMIT:
+                if mode == EigMode.LAP: return sparse_smallest_general_eigs(matrix, k)
+                return eigs(matrix.astype(np.float64), k = min(k, n - 2), which = "LM")
+            if sp.issparse(matrix): matrix = matrix.toarray()
+            return np.linalg.eig(matrix)
+        case EigSolver.SYMMETRIC:
+            if sp.issparse(matrix): matrix = matrix.toarray()
+            return np.linalg.eigh(matrix)
+        case EigSolver.PARTIAL:
+            k = min(k, n - 2)
+            if mode == EigMode.LAP: return sparse_smallest_eigs(matrix, k)
+            return eigsh(sp.csr_array(matrix, dtype = np.float64), k = k, which = "LM")
+        case _:
+            return solve_eigs(matrix, choose_solver(matrix), mode, k)
+
+# Returns the k smallest non-zero eigenvalues of a (symmetric) laplacian and their
+# eigenvectors, without building a dense matrix. The zero eigenvalues (one per
+# connected component) are projected out, so the result starts at the smallest
+# non-zero eigenvalue, like find_smallest_eigs.
+# x0 is an optional starting guess (one column per eigenvector), for refining a
+# previous result in a few iterations.
+def sparse_smallest_eigs(laplacian, k : int = 2, x0 : np.array = None,
+        maxiter : int = SPARSE_EIG_MAXITER) -> Tuple[np.array, np.array]:
+    laplacian = sp.csr_array(laplacian, dtype = np.float64)
+    n = laplacian.shape[0]
+
+    # Isolated vertices only add zero eigenvalues, and every other eigenvector is 0 on
+    # them, so they are left out of the solve.
+    active = np.flatnonzero(laplacian.diagonal() != 0)
+    sub = laplacian[active][:, active]
+    (n_comps, labels) = connected_components(sub, directed = False)
+    n_nonzero = active.size - n_comps
+
+    # lobpcg needs at least 5 times as many rows as eigenvectors (it goes dense otherwise,
+    # which doesn't support the constraints), so solve small subgraphs densely.
+    if n_nonzero < 5 * k and active.size <= PARTIAL_SOLVER_LIMIT:
+        k = max(min(k, n_nonzero), 0)
+        (sub_vals, sub_vecs) = np.linalg.eigh(sub.toarray())
+        vecs = np.zeros((n, k))
+        vecs[active] = sub_vecs[:, n_comps:n_comps + k]
+        return (sub_vals[n_comps:n_comps + k], vecs)
+
+    k = max(min(k, n_nonzero - 1), 0)
+    vecs = np.zeros((n, k))
+    if k == 0: return (np.zeros(0), vecs)
+
+    if n_comps > MAX_CONSTRAINED_COMPONENTS:
+        # Shift-invert around just below 0 finds the smallest eigenvalues quickly.
+        sub_vals, sub_vecs = eigsh(sub, k = k + n_comps, sigma = SHIFT_INVERT_SIGMA,
+            which = "LM")
+        order = np.argsort(sub_vals)[n_comps:]
+        vecs[active] = sub_vecs[:, order]
+        return (sub_vals[order], vecs)
+
+    # Normalized indicator vector of each component spans the null space.
+    null_space = np.zeros((active.size, n_comps))
+    null_space[np.arange(active.size), labels] = 1
+    null_space /= np.sqrt(null_space.sum(axis=0))
+
+    # Jacobi preconditioner
+    precond = sp.diags_array(1 / sub.diagonal())
+
+    x = np.random.default_rng(0).standard_normal((active.size, k))
+    if x0 is not None:
+        # A little noise keeps the guess full rank.
+        x = x0[active, :k] + x * 1e-3 * (np.abs(x0[active, :k]).max() + 1e-12)
+    with warnings.catch_warnings():
+        # Not reaching the tolerance exactly is fine for drawing, so don't spam warnings.
+        warnings.simplefilter("ignore", UserWarning)
+        sub_vals, sub_vecs = lobpcg(sub, x, M = precond, Y = null_space, largest = False,
+            tol = SPARSE_EIG_TOL, maxiter = maxiter)
+    order = np.argsort(sub_vals)
+    vecs[active] = sub_vecs[:, order]
+    return (sub_vals[order], vecs)
+
+# Returns the k smallest non-zero eigenvalues (by real part) of a non-symmetric sparse
+# laplacian and their eigenvectors, like sparse_smallest_eigs. Shift-invert finds the
+# ones closest to 0, with enough extra to cover one zero eigenvalue per (weakly)
+# connected component, which are then dropped.
+def sparse_smallest_general_eigs(laplacian, k : int = 2) -> Tuple[np.array, np.array]:
+    laplacian = sp.csc_array(laplacian, dtype = np.float64)
+    n = laplacian.shape[0]
+    (n_comps, _) = connected_components(laplacian, directed = True, connection = "weak")
+    n_eigs = min(k + n_comps, n - 2)
+    (vals, vecs) = eigs(laplacian, k = n_eigs, sigma = SHIFT_INVERT_SIGMA, which = "LM")
+    order = np.argsort(np.real(vals))
+    (vals, vecs) = (vals[order], vecs[:, order])
+    tol = ZERO_EIG_TOL * max(np.abs(vals).max(initial = 0), 1)
+    nonzero = np.flatnonzero(np.abs(vals) > tol)[:k]
+    return (vals[nonzero], vecs[:, nonzero])
+
+# Rotates/reflects coords so they line up as well as possible with a previous layout
+# (orthogonal Procrustes over the vertices that are in both), so that the drawing
+# doesn't flip or spin between frames.
+def align_coords(coords : np.array, ids : np.array, prev_ids : np.array,
+        prev_coords : np.array) -> np.array:
+    (common, rows, prev_rows) = np.intersect1d(ids, prev_ids, assume_unique = True,
+        return_indices = True)
+    if common.size < 2: return coords
+    (u, _, vt) = np.linalg.svd(coords[rows].T @ prev_coords[prev_rows])
+    return coords @ (u @ vt)
+
 # Returns two smallest non-zero eigenvalues of a matrix.
 def find_smallest_eigs(adj_matrix : np.array) -> Tuple[int]:
-    diag = np.diag(np.sum(adj_matrix, axis=0))
-    laplacian = np.subtract(diag, adj_matrix)
-    eig_vals = np.linalg.eig(laplacian).eigenvalues
-
-    lowest_is = [0,0]
-    lowest_vals = [math.inf, math.inf]
-    i = -1
-    for e in eig_vals:
-        i += 1
-        # We round because a number that is very close to 0 will result in a bad graph.
-        e_r = round(e, ROUND_DIGITS)
-
-        if e_r <= 0: continue
-        if e_r < lowest_vals[0]:
-            lowest_is = [i, lowest_is[0]]
-            lowest_vals = [eig_vals[i], lowest_vals[0]]
-            continue
-        if e_r < lowest_vals[1]:
-            lowest_is[1] = i
-            lowest_vals[1] = eig_vals[i]
-    print(lowest_is[0])
-    return lowest_is
+    laplacian = calc_laplacian(adj_matrix)
+    return find_smallest_nonzero(np.linalg.eig(laplacian).eigenvalues)
+
+# Returns the indices of the two smallest non-zero values in a list of eigenvalues.
+def find_smallest_nonzero(eig_vals : np.array) -> Tuple[int]:
+    # Zero eigenvalues come out as tiny numbers that would result in a bad graph.
+    real = np.real(eig_vals)
+    tol = ZERO_EIG_TOL * max(np.abs(real).max(initial = 0), 1)
+    nonzero = np.flatnonzero(real > tol)
+    lowest_is = nonzero[np.argsort(real[nonzero], kind = "stable")[:2]].tolist()
+    return (lowest_is + [0, 0])[:2]
 
 # Returns list of object coordinates after applying eigenvector conversions to
 # cartesian coordinates.
 # Format of array: each row is a node: [x, y]
 def calc_graph_eig(adj_matrix : np.array, x_coords_index : int = 0,
         y_coords_index : int = 1) -> np.array:
-    diag = np.diag(np.sum(adj_matrix, axis=0))
-    laplacian = np.subtract(diag, adj_matrix)
+    laplacian = calc_laplacian(adj_matrix)
 
     eigs = np.linalg.eig(laplacian).eigenvectors
 
@@ -0,0 +1,312 @@
+from graph import Graph, EigMode
+from typing import List, Tuple
+import scipy.sparse as sp
+import numpy as np
+import hashlib
+import json
+import math
+import time
+import re
+import os
+
+CHUNK_BYTES = 8 * 2**20     # About how much of the file is parsed at once.
+# Blank lines, and lines starting with # or % (comments), are skipped in edge lists.
+SKIPPED_LINES = re.compile(r"^[ \t]*(?:[#%].*)?\r?\n", re.MULTILINE)
+
+# Readers for graph files. Files are parsed a chunk of lines at a time, so memory use
+# while parsing doesn't depend on the file size, and the adjacency is built directly as
+# a sparse matrix.
+
+# Maps arbitrary vertex labels (strings) to compact IDs 0..n-1, in order of appearance.
+# The known labels are kept sorted, so a chunk of labels is looked up with one
+# searchsorted instead of a dict lookup each.
+class LabelMap:
+    def __init__(self) -> None:
+        self.sorted_labels : np.array = np.zeros(0, dtype = str)
+        self.sorted_ids : np.array = np.zeros(0, dtype = np.int64)
+        self.labels : List[np.array] = []     # New labels of every chunk, in ID order
+        self.size : int = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    # Returns the label of every ID.
+    def get_labels(self) -> List[str]:
+        if len(self.labels) == 0: return []
+        return np.concatenate(self.labels).tolist()
+
+    # Returns the ID of every label, adding the new ones.
+    def map(self, labels : np.array) -> np.array:
+        if len(labels) == 0: return np.zeros(0, dtype = np.int64)
+        (unique, first, inverse) = np.unique(labels, return_index = True, return_inverse = True)
+        where = np.searchsorted(self.sorted_labels, unique)
+        found = where < len(self.sorted_labels)
+        found[found] = self.sorted_labels[where[found]] == unique[found]
+
+        unique_ids = np.empty(len(unique), dtype = np.int64)
+        unique_ids[found] = self.sorted_ids[where[found]]
+        # New labels are numbered in the order they first appear.
+        new = np.flatnonzero(~found)
+        new = new[np.argsort(first[new], kind = "stable")]
+        unique_ids[new] = np.arange(self.size, self.size + len(new))
+        self.size += len(new)
+        self.labels.append(unique[new])
+
+        # Both are sorted, so the new labels can be inserted without sorting again.
+        # The longest label decides the dtype, so it may have to grow first.
+        new = np.flatnonzero(~found)
+        dtype = np.promote_types(self.sorted_labels.dtype, unique.dtype)
+        self.sorted_labels = np.insert(self.sorted_labels.astype(dtype, copy = False),
+            where[new], unique[new])
+        self.sorted_ids = np.insert(self.sorted_ids, where[new], unique_ids[new])
+        return unique_ids[inverse.ravel()]
+
+# Prints how fast a file was read.
+def report_throughput(path : str, n_edges : int, seconds : float) -> None:
+    size = os.path.getsize(path) / 2**20
+    seconds = max(seconds, 1e-9)
+    print(f"Read {n_edges} edges ({size:.1f} MB) from {path} in {seconds:.2f} s "
+        f"({n_edges / seconds:,.0f} edges/s, {size / seconds:.1f} MB/s)")
+
+# Returns the first two fields of every line (skipping blank and comment lines) as an
+# (n, 2) array of strings, or None if a line has less than two.
+def parse_edges(lines : List[str], delimiter : str = None) -> np.array:
+    if not lines[-1].endswith("\n"): lines[-1] += "\n"   # Last line of the file
+    text = SKIPPED_LINES.sub("", "".join(lines))
+    if len(text) == 0: return np.zeros((0, 2), dtype = str)
+    n_lines = text.count("\n")
+    n_fields = len(text[:text.index("\n")].split(delimiter))
+    if n_fields < 2: return None
+
+    # Usually every line has the same number of fields, and the whole chunk can be split
+    # at once. Line ends are kept as a marker field, so that a row of n_fields + 1 fields
+    # ending in the marker means that line had exactly n_fields.
+    if delimiter is None:
+        fields = text.replace("\n", " \0 ").split()
+    else:
+        fields = text.replace("\n", delimiter + "\0" + delimiter).split(delimiter)[:-1]
+    if len(fields) == (n_fields + 1) * n_lines:
+        fields = np.array(fields).reshape(-1, n_fields + 1)
+        if np.all(fields[:, -1] == "\0"):
+            fields = fields[:, :2]
+            return fields if delimiter is None else np.char.strip(fields)
+
+    pairs = []
+    for line in text.splitlines():
+        fields = line.split(delimiter)
+        if len(fields) < 2: return None
+        pairs.append((fields[0].strip(), fields[1].strip()))
+    return np.array(pairs)
+
+# Reads an edge list: one edge per line, as two vertex labels separated by the delimiter
+# (None means any whitespace). Extra columns (e.g. weights) are ignored. Returns the
+# graph and the label of every vertex ID.
+def read_edge_list(path : str, delimiter : str = None, skip_header : bool = False,
+        directed : bool = False, chunk_bytes : int = CHUNK_BYTES,
+        report : bool = True) -> Tuple[Graph, List[str]]:
+    start = time.perf_counter()
+    label_map = LabelMap()
+    (rows, cols) = ([], [])
+    with open(path, "r") as f:
+        if skip_header: f.readline()
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if len(lines) == 0: break
+            pairs = parse_edges(lines, delimiter)
+            if pairs is None:
+                print(f"ERROR: could not read edges from {path}, every line needs two labels")
+                return (None, None)
+            if len(pairs) == 0: continue
+            ids = label_map.map(pairs.ravel()).reshape(-1, 2)
+            rows.append(ids[:, 0])
+            cols.append(ids[:, 1])
+
+    rows = np.concatenate(rows) if len(rows) else np.zeros(0, dtype = np.int64)
+    cols = np.concatenate(cols) if len(cols) else np.zeros(0, dtype = np.int64)
+    graph = Graph.from_edges(rows, cols, len(label_map), directed = directed)
+    if report: report_throughput(path, len(rows), time.perf_counter() - start)
+    return (graph, label_map.get_labels())
+
+# Reads a Matrix Market coordinate file. Every stored nonzero entry is an edge, and
+# symmetric files only store one triangle. Vertex labels are the 1-based indices.
+def read_matrix_market(path : str, directed : bool = False, chunk_bytes : int = CHUNK_BYTES,
+        report : bool = True) -> Tuple[Graph, List[str]]:
+    start = time.perf_counter()
+    (rows, cols) = ([], [])
+    with open(path, "r") as f:
+        header = f.readline().lower().split()
+        if len(header) < 5 or header[0] != "%%matrixmarket" or header[1] != "matrix":
+            print(f"ERROR: {path} is not a Matrix Market matrix file")
+            return (None, None)
+        (layout, field, symmetry) = header[2:5]
+        if layout != "coordinate":
+            print(f"ERROR: only coordinate Matrix Market files are supported, {path} is {layout}")
+            return (None, None)
+        if field == "complex":
+            print(f"ERROR: complex Matrix Market files are not supported")
+            return (None, None)
+
+        line = f.readline()
+        while line.startswith("%") or len(line.strip()) == 0: line = f.readline()
+        (n_rows, n_cols, n_entries) = [int(x) for x in line.split()]
+        size = max(n_rows, n_cols)
+        n_fields = 2 if field == "pattern" else 3
+
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if len(lines) == 0: break
+            lines = [l for l in lines if not l.startswith("%")]
+            entries = np.array(" ".join(lines).split(), dtype = np.float64).reshape(-1, n_fields)
+            # Explicitly stored zeros aren't edges.
+            if n_fields == 3: entries = entries[entries[:, 2] != 0]
+            rows.append(entries[:, 0].astype(np.int64) - 1)
+            cols.append(entries[:, 1].astype(np.int64) - 1)
+
+    rows = np.concatenate(rows) if len(rows) else np.zeros(0, dtype = np.int64)
+    cols = np.concatenate(cols) if len(cols) else np.zeros(0, dtype = np.int64)
+    # Symmetric files only have one triangle, so the other one is always added.
+    graph = Graph.from_edges(rows, cols, size, directed = directed and symmetry == "general")
+    if report: report_throughput(path, len(rows), time.perf_counter() - start)
+    return (graph, [str(i + 1) for i in range(size)])
+
+# Reads a graph file, picking the format from the extension: .mtx is Matrix Market,
+# .csv is a comma separated edge list (with a header, unless skip_header = False),
+# anything else is a whitespace separated edge list.
+def read_graph(path : str, **kwargs) -> Tuple[Graph, List[str]]:
+    match os.path.splitext(path)[1].lower():
+        case ".mtx":
+            return read_matrix_market(path, **kwargs)
+        case ".csv":
+            kwargs.setdefault("skip_header", True)
+            return read_edge_list(path, delimiter = ",", **kwargs)
+        case _:
+            return read_edge_list(path, **kwargs)
+
+# ___________________________
+# ----- BINARY SNAPSHOTS -----
+# ___________________________
+
+# A snapshot is a directory with one .npy file per array (adjacency, vertex IDs, labels,
+# cached eigenpairs and coords) and a header.json, written last, that describes them.
+# Loading memory-maps the arrays, so it pages the data in lazily. The header holds a hash
+# of every array, checked on load unless verify is off.
+SNAPSHOT_FORMAT = 2
+HASH_BLOCK_BYTES = 64 * 2**20
+# Eigenvalues computed (and stored) by load_graph, on top of the layout.
+SNAPSHOT_EIG_MODES = [EigMode.ADJ]
+
+# SHA-256 of the dtype, shape and contents of arrays, read in blocks so memory-mapped
+# arrays aren't loaded all at once.
+def hash_arrays(arrays : List[np.array]) -> str:
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        flat = array.reshape(-1).view(np.uint8)
+        for start in range(0, flat.size, HASH_BLOCK_BYTES):
+            digest.update(flat[start:start + HASH_BLOCK_BYTES])
+    return digest.hexdigest()
+
+# Returns the adjacency of the graph as named arrays.
+def adjacency_arrays(graph : Graph) -> dict:
+    ids = graph.vertex_ids()
+    if not graph.sparse: return {"adj": np.asarray(graph.adj_matrix), "ids": ids}
+    adj = sp.csr_array(graph.adj_matrix)
+    return {"adj_data": adj.data, "adj_indices": adj.indices, "adj_indptr": adj.indptr,
+        "ids": ids}
+
+# Size and modification time of a file, to tell if a snapshot of it is stale.
+def source_stamp(path : str) -> dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# Writes the graph, its labels, and whatever eigenpairs and layout it has cached for its
+# current version, to a snapshot directory. source is the file the graph was read from.
+def save_snapshot(graph : Graph, path : str, labels : List[str] = None,
+        source : str = None) -> None:
+    os.makedirs(path, exist_ok = True)
+    header_path = os.path.join(path, "header.json")
+    # Without a header the directory isn't a snapshot, so a half written one is ignored.
+    if os.path.exists(header_path): os.remove(header_path)
+
+    arrays = adjacency_arrays(graph)
+    header = {"format": SNAPSHOT_FORMAT, "sparse": graph.sparse, "size": graph.size,
+        "next_id": graph.next_id, "source": source_stamp(source) if source is not None else None,
+        "eigs": {}, "coords": False, "labels": labels is not None}
+    if labels is not None: arrays["labels"] = np.array(labels, dtype = str)
+    for (mode, (version, vals, vecs, k)) in graph.eig_cache.items():
+        if version != graph.version: continue
+        arrays[f"eig_vals_{mode}"] = np.asarray(vals)
+        arrays[f"eig_vecs_{mode}"] = np.asarray(vecs)
+        header["eigs"][str(mode)] = None if k == math.inf else int(k)
+    (version, ids, coords) = graph.layout_cache
+    if version == graph.version:
+        arrays["coords"] = np.asarray(coords)
+        header["coords"] = True
+    header["arrays"] = sorted(arrays)
+    header["hash"] = hash_arrays([arrays[name] for name in header["arrays"]])
+
+    for (name, array) in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    with open(header_path, "w") as f:
+        json.dump(header, f, indent = 2)
+
+# Loads a snapshot, with the arrays memory-mapped (copy on write, so the graph can still
+# be edited). Returns (graph, labels), or (None, None) if there is no snapshot or it is
+# stale: written by another format version, for a source file that has changed since,
+# or (if verify) with arrays that don't match its hash.
+def load_snapshot(path : str, source : str = None,
+        verify : bool = True) -> Tuple[Graph, List[str]]:
+    header_path = os.path.join(path, "header.json")
+    if not os.path.exists(header_path): return (None, None)
+    with open(header_path, "r") as f:
+        header = json.load(f)
+    if header.get("format") != SNAPSHOT_FORMAT: return (None, None)
+    if source is not None and header["source"] != source_stamp(source): return (None, None)
+
+    try:
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode = "c")
+            for name in header["arrays"]}
+    except (OSError, ValueError) as e:
+        print(f"ERROR: could not read snapshot {path}, ignoring it: {e}")
+        return (None, None)
+    if verify and hash_arrays([arrays[name] for name in header["arrays"]]) != header["hash"]:
+        print(f"ERROR: snapshot {path} doesn't match its hash, ignoring it")
+        return (None, None)
+
+    if header["sparse"]:
+        adj = sp.csr_array((arrays["adj_data"], arrays["adj_indices"], arrays["adj_indptr"]),
+            shape = (header["size"], header["size"]))
+    else:
+        adj = arrays["adj"]
+    ids = arrays["ids"]
+
+    graph = Graph(adj, sparse = header["sparse"])
+    graph.slot_ids[:] = ids
+    graph.next_id = header["next_id"]
+    for (mode, k) in header["eigs"].items():
+        graph.eig_cache[int(mode)] = (graph.version, arrays[f"eig_vals_{mode}"],
+            arrays[f"eig_vecs_{mode}"], math.inf if k is None else k)
+    if header["coords"]:
+        graph.layout_cache = (graph.version, graph.vertex_ids().copy(), arrays["coords"])
+    labels = arrays["labels"].tolist() if header["labels"] else None
+    return (graph, labels)
+
+# Reads a graph file through its snapshot (path + ".snapshot"). If the snapshot is
+# missing or stale, the file is read again, its layout and spectra computed, and the
+# snapshot rewritten, so the next load is fast. verify checks the snapshot's hash, which
+# reads every array once; turn it off for a lazy, near instant load of a trusted snapshot.
+def load_graph(path : str, snapshot_path : str = None,
+        eig_modes : List[int] = SNAPSHOT_EIG_MODES,
+        verify : bool = True) -> Tuple[Graph, List[str]]:
+    if snapshot_path is None: snapshot_path = path + ".snapshot"
+    (graph, labels) = load_snapshot(snapshot_path, source = path, verify = verify)
+    if graph is not None: return (graph, labels)
+
+    (graph, labels) = read_graph(path)
+    if graph is None: return (None, None)
+    graph.get_coords()
+    for mode in eig_modes:
+        graph.get_eig_vals(mode)
+    save_snapshot(graph, snapshot_path, labels, source = path)
+    return (graph, labels)
@@ -2,81 +2,415 @@ from typing import List, Tuple
 from pyUI import *
 from graph import Graph, EigMode
 from pyUI import AxisType, UIObject
+from layoutWorker import LayoutWorker
+from ForceSim import ForceSim
+from rasterRender import rasterize_lines, rasterize_points, draw_density, clip_lines
+from spatialIndex import GridIndex
+from frameProfiler import frame_profiler
+from typing import Callable
+from scipy.spatial import cKDTree
 import numpy as np
 
+# Graphs with more vertices + edges than this are drawn as a density raster by default.
+RASTER_THRESHOLD = 50000
+MIN_ZOOM = 0.5
+MAX_ZOOM = 1e6
+
+# Draws a graph using its eigenvector coords. If a LayoutWorker is given, the coords are
+# computed in the background, and the last finished layout is drawn in the meantime
+# (with a border in computing_color while a newer one is being computed).
+# Big graphs (see raster_threshold) are drawn as a density raster: each pixel's alpha
+# shows how many edges or vertices cover it.
+# The view can be zoomed and panned. When zoomed in, only the vertices and edges in view
+# are looked up (through a GridIndex over the layout) and drawn.
 class GraphUIObject(UIObject):
     def __init__(self, x : float = 0, y : float = 0, width : float = 0, height : float = 0,
             bg_color : Tuple[int] = (0, 0, 0), scaling_axis : int = AxisType.BOTH,
             coord_axis : int = AxisType.BOTH, graph : Graph = None,
             vertex_radius : int = 10, vertex_color : Tuple[int] = (255, 0, 0),
-            edge_width : int = 1, edge_color : Tuple[int] = (255, 255, 255)) -> None:
+            edge_width : int = 1, edge_color : Tuple[int] = (255, 255, 255),
+            worker : LayoutWorker = None,
+            computing_color : Tuple[int] = (255, 200, 0),
+            raster_threshold : int = RASTER_THRESHOLD,
+            hover_color : Tuple[int] = (255, 255, 0),
+            on_vertex_click : Callable[[int], None] = None,
+            label_font : pygame.font.Font = None,
+            label_color : Tuple[int] = (255, 255, 255)) -> None:
         super().__init__(x, y, width, height, bg_color, scaling_axis, coord_axis)
         self.graph : Graph = graph
         self.vertex_radius : int = vertex_radius
         self.vertex_color : Tuple[int] = vertex_color
         self.edge_width : int = edge_width
         self.edge_color : Tuple[int] = edge_color
+        self.worker : LayoutWorker = worker
+        self.computing_color : Tuple[int] = computing_color
+        # Above this many vertices + edges, the graph is drawn as a density raster.
+        self.raster_threshold : int = raster_threshold
+        self.hover_color : Tuple[int] = hover_color
+        # Called with the ID of the vertex that was clicked.
+        self.on_vertex_click : Callable[[int], None] = on_vertex_click
+        # If given, vertices are labeled with their IDs (except when drawn as a raster).
+        self.label_font : pygame.font.Font = label_font
+        self.label_color : Tuple[int] = label_color
 
         # Eigenvector coords (from -1 to 1)
-        self.vertex_coords : np.array = np.zeros((2, self.graph.size))
+        self.vertex_coords : np.array = np.zeros((0, 2))
+        # The graph (or snapshot of it) that vertex_coords are for.
+        self.layout_graph : Graph = None
+        self.computing : bool = False
+        # ((radius, color), surface) of the pre-drawn vertex circle.
+        self.vertex_sprite : Tuple = None
+        # While a force layout is running, its coords are drawn instead of the worker's.
+        self.force_sim : ForceSim = None
+        # The newest layout_task. Older ones stop on their next call.
+        self.force_task : Callable[[], bool] = None
+        # Graph version the last force layout ran on. Its coords are kept (over worker
+        # results for the same or older versions) until the graph changes.
+        self.force_version : int = -1
+
+        # Viewport: the layout point at the center of the rect, and how far it is zoomed in.
+        self.center : np.array = np.zeros(2)
+        self.zoom : float = 1
+        # (coords, graph, index) of the spatial index, rebuilt when the layout changes.
+        self.index : Tuple = None
+        # (coords, rect size, tree) of the KD-tree used for picking vertices.
+        self.pick_tree : Tuple = None
+        # ID of the vertex under the mouse, or None.
+        self.hovered_vertex : int = None
+
+    # Converts layout coords to screen pixels, for the current viewport.
+    def layout_to_screen(self, points : np.array) -> np.array:
+        size = np.array(self.rect.size, dtype = np.float64)
+        return ((np.asarray(points, dtype = np.float64) - self.center) * self.zoom + 1) / 2 * size \
+            + self.rect.topleft
+
+    def screen_to_layout(self, pos : Tuple[int]) -> np.array:
+        size = np.array(self.rect.size, dtype = np.float64)
+        return ((np.asarray(pos, dtype = np.float64) - self.rect.topleft) / size * 2 - 1) \
+            / self.zoom + self.center
+
+    # Zooms in (factor > 1) or out, keeping the layout point under pos in place.
+    def zoom_at(self, factor : float, pos : Tuple[int]) -> None:
+        if self.rect is None: return
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        point = self.screen_to_layout(pos)
+        self.center = point - (point - self.center) * self.zoom / zoom
+        self.zoom = zoom
+        self.changed = True
+
+    # Moves the view by a distance in pixels.
+    def pan(self, dx : float, dy : float) -> None:
+        if self.rect is None: return
+        self.center = self.center - np.array([dx, dy]) * 2 / (np.array(self.rect.size) * self.zoom)
+        self.changed = True
+
+    def reset_view(self) -> None:
+        self.center = np.zeros(2)
+        self.zoom = 1
+        self.changed = True
+
+    # Returns the spatial index over the drawn layout, only rebuilt when it changes.
+    def get_index(self, rows : np.array, cols : np.array) -> GridIndex:
+        if (self.index is None or self.index[0] is not self.vertex_coords
+                or self.index[1] is not self.layout_graph):
+            index = GridIndex(self.vertex_coords, rows, cols)
+            self.index = (self.vertex_coords, self.layout_graph, index)
+        return self.index[2]
+
+    # Returns the KD-tree over the vertices in screen space (at zoom 1, not offset), only
+    # rebuilt when the layout or the size of the rect changes.
+    def get_pick_tree(self) -> cKDTree:
+        size = self.rect.size
+        if (self.pick_tree is None or self.pick_tree[0] is not self.vertex_coords
+                or self.pick_tree[1] != size):
+            scale = np.array(size, dtype = np.float64) / 2
+            tree = cKDTree(np.asarray(self.vertex_coords, dtype = np.float64) * scale)
+            self.pick_tree = (self.vertex_coords, size, tree)
+        return self.pick_tree[2]
+
+    # Returns the ID of the vertex drawn at the screen position, or None. O(log n).
+    def pick_vertex(self, pos : Tuple[int]) -> int:
+        if self.rect is None or self.layout_graph is None or len(self.vertex_coords) == 0:
+            return None
+        scale = np.array(self.rect.size, dtype = np.float64) / 2
+        point = self.screen_to_layout(pos) * scale
+        # Distances in the tree are zoom times smaller than on screen.
+        (dist, index) = self.get_pick_tree().query(point,
+            distance_upper_bound = (self.vertex_radius + 1) / self.zoom)
+        if not np.isfinite(dist): return None
+        return int(self.layout_graph.vertex_ids()[index])
+
+    # Returns the row of vertex_coords for a vertex ID, or None if it isn't drawn.
+    def get_vertex_index(self, vertex_id : int) -> int:
+        if vertex_id is None or self.layout_graph is None: return None
+        index = int(self.layout_graph.index_of([vertex_id])[0])
+        if index < 0 or index >= len(self.vertex_coords): return None
+        return index
+
+    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect = None):
+        vertex_id = self.pick_vertex(pos)
+        if vertex_id is not None and self.on_vertex_click is not None:
+            self.on_vertex_click(vertex_id)
+
+    def activate_hover(self, pos : Tuple[int]):
+        vertex_id = None
+        if self.rect is not None and point_in_rect(self.rect, pos): vertex_id = self.pick_vertex(pos)
+        if vertex_id != self.hovered_vertex:
+            self.hovered_vertex = vertex_id
+            self.changed = True
+
+    # Returns (vertices, edges) in view, as indices into vertex_coords and the edge index.
+    # None means everything is in view. pad is in pixels.
+    def get_visible(self, rows : np.array, cols : np.array, pad : float) -> Tuple:
+        if self.zoom <= 1 and not self.center.any(): return (None, None)
+        index = self.get_index(rows, cols)
+        low = self.screen_to_layout((self.rect.left - pad, self.rect.top - pad))
+        high = self.screen_to_layout((self.rect.right + pad, self.rect.bottom + pad))
+        if index.covers(low, high): return (None, None)
+        return (index.query_vertices(low, high), index.query_edges(low, high))
+
+    # Returns a surface with one vertex drawn on it, only redrawn if the radius or color
+    # have changed.
+    def get_vertex_sprite(self) -> pygame.Surface:
+        key = (self.vertex_radius, tuple(self.vertex_color))
+        if self.vertex_sprite is None or self.vertex_sprite[0] != key:
+            r = self.vertex_radius
+            sprite = pygame.Surface((2 * r + 1, 2 * r + 1), pygame.SRCALPHA)
+            sprite.fill((0, 0, 0, 0))
+            pygame.draw.circle(sprite, self.vertex_color, (r, r), r)
+            frame_profiler.count("surfaces")
+            frame_profiler.count("draw_calls")
+            self.vertex_sprite = (key, sprite)
+        return self.vertex_sprite[1]
+
+    # Returns a task (see Screen.add_task) that runs a force layout one step per call,
+    # drawing the coords after each step, until it cools down. The layout is made with
+    # make_sim(graph, coords = start coords) from the worker's result, and made again
+    # whenever the graph changes. Until the worker has the current version, the task
+    # waits instead of computing the spectral layout on this thread.
+    def layout_task(self, make_sim : Callable[..., ForceSim] = ForceSim) -> Callable[[], bool]:
+        sim : ForceSim = None
+        def task() -> bool:
+            nonlocal sim
+            if self.force_task is not task: return False    # Replaced by a newer one
+            if sim is None or sim.version != self.graph.version:
+                start = self.get_force_start()
+                if start is None:
+                    # Waits for the worker, unless it failed on this version.
+                    if self.worker.is_computing(): return None
+                    (self.force_sim, self.force_task) = (None, None)
+                    return False
+                (graph, coords) = start
+                sim = make_sim(graph, coords = coords)
+                self.force_sim = sim
+            self.vertex_coords = sim.step()
+            # sim.graph is a snapshot, so edits to the graph don't get ahead of the coords.
+            self.layout_graph = sim.graph
+            self.force_version = sim.version
+            self.changed = True
+            if not sim.is_done(): return True
+            (self.force_sim, self.force_task) = (None, None)
+            return False
+        self.force_task = task
+        return task
+
+    # Returns (graph snapshot, coords) for a force layout to start from, or None if the
+    # worker doesn't have the layout of the current version yet.
+    def get_force_start(self) -> Tuple:
+        if self.worker is None: return (self.graph.snapshot(take_deltas = False), None)
+        self.worker.request()
+        result = self.worker.result
+        if result is None or result.version != self.graph.version: return None
+        return (result.graph, result.coords)
+
+    def is_busy(self) -> bool:
+        if self.worker is None: return self.graph.changed
+        return (self.computing or self.worker.is_computing()
+            or self.graph.version != self.worker.requested_version or self.has_new_layout())
+
+    # Whether the worker has a layout that should replace the drawn one.
+    def has_new_layout(self) -> bool:
+        result = self.worker.result
+        return (result is not None and result.graph is not self.layout_graph
+            and self.force_sim is None and result.version > self.force_version)
+
+    # Picks up a new layout from the worker, if there is one.
+    def update_layout(self) -> None:
+        self.worker.request()
+        result = self.worker.result
+        if self.has_new_layout():
+            self.vertex_coords = result.coords
+            self.layout_graph = result.graph
+            self.changed = True
+        if self.computing != self.worker.is_computing():
+            self.computing = not self.computing
+            self.changed = True
     
     def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
             p_width : float = 0, p_height : float = 0) -> None:
-        if self.graph.changed: self.changed = True  # TODO: Kinda jank
+        if self.worker is not None: self.update_layout()
+        elif self.graph.changed: self.changed = True  # TODO: Kinda jank
         if self.changed:
-            if self.graph.changed:
+            if self.worker is None and self.graph.changed:
                 # We need to calculate new coords
                 self.vertex_coords = self.graph.get_coords()
+                self.layout_graph = self.graph
                 self.graph.changed = False
             
             # Background
-            rect = rect_from_p(self.x, self.y, self.width, self.height,
-                p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+            rect = self.get_rect(p_x, p_y, p_width, p_height)
             pygame.draw.rect(surface, self.bg_color, rect)
+            if self.computing: pygame.draw.rect(surface, self.computing_color, rect, 1)
+            frame_profiler.count("draw_calls", 2 if self.computing else 1)
 
-            # Convert all coordinates to screen space
-            coords = []
-            i : int = 0
-            for (x1, y1) in self.vertex_coords:
-                # Normalize x, y from -1 to 1 to 0 to 1.
-                x1 = (x1 + 1) / 2
-                y1 = (y1 + 1) / 2
+            # The layers have a margin, so that vertices just outside the rect still draw
+            # the part of them that is inside. Only the part inside the rect is blitted.
+            margin = self.vertex_radius + self.edge_width
+            area = rect.inflate(2 * margin, 2 * margin)
 
-                # Scale and offset to UIObject
-                x = (x1 * self.width * p_width) + (p_width * self.x) + p_x
-                y = (y1 * self.height * p_height) + (p_height * self.y) + p_y
+            (rows, cols) = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))
+            if self.layout_graph is not None and len(self.vertex_coords):
+                (rows, cols) = self.layout_graph.get_edge_index()
+            (vertices, edges) = self.get_visible(rows, cols, margin)
+            if edges is not None: (rows, cols) = (rows[edges], cols[edges])
+            points = self.vertex_coords if vertices is None else self.vertex_coords[vertices]
 
-                coords.append([x, y])
-                i += 1
+            # Convert the coordinates in view to layer space at once.
+            offset = np.array(area.topleft)
+            coords = self.layout_to_screen(points) - offset
+            starts = self.layout_to_screen(self.vertex_coords[rows]) - offset
+            ends = self.layout_to_screen(self.vertex_coords[cols]) - offset
 
             # Draw graph
             # Keep seperate surfaces so that the vertices are always drawn over the edges.
-            vertex_surf = pygame.Surface((p_width, p_height), pygame.SRCALPHA)
-            vertex_surf.fill((0, 0, 0, 0))
+            vertex_surf = self.get_layer("vertices", area.size)
+            edge_surf = self.get_layer("edges", area.size)
 
-            edge_surf = pygame.Surface((p_width, p_height), pygame.SRCALPHA)
-            edge_surf.fill((0, 0, 0, 0))
-            
-            vertex_index : int = 0
-            for (x1, y1) in coords:
-                # Draw edges
-                # TODO: Draws duplicate edges (exactly twice as many)
-                edge_index : int = 0
-                for c in self.graph.get_connections(vertex_index):
-                    if c:
-                        (x2, y2) = coords[edge_index]
-                        pygame.draw.line(edge_surf, self.edge_color, (x1, y1), (x2, y2), self.edge_width)
-                    edge_index += 1
-
-                # Draw vertex
-                pygame.draw.circle(vertex_surf, self.vertex_color, (x1, y1), self.vertex_radius)
-                vertex_index += 1
-
-            surface.blit(edge_surf, (0, 0))
-            surface.blit(vertex_surf, (0, 0))
+            if len(coords) + len(rows) > self.raster_threshold:
+                # Too many elements to draw one by one, draw their density instead.
+                edge_counts = np.zeros(area.size, dtype = np.int32)
+                rasterize_lines(edge_counts, starts, ends)
+                draw_density(edge_surf, edge_counts, self.edge_color)
+                vertex_counts = np.zeros(area.size, dtype = np.int32)
+                rasterize_points(vertex_counts, coords)
+                draw_density(vertex_surf, vertex_counts, self.vertex_color)
+            else:
+                # Every edge once. pygame has no call for many separate segments, so this is
+                # one draw call per edge, but no work per non-edge. Clipping first keeps
+                # the ends of edges going far out of view (when zoomed in) small.
+                (starts, ends) = clip_lines(starts, ends, area.width, area.height)
+                starts = starts.tolist()
+                ends = ends.tolist()
+                for (start, end) in zip(starts, ends):
+                    pygame.draw.line(edge_surf, self.edge_color, start, end, self.edge_width)
+                frame_profiler.count("draw_calls", len(starts))
+
+                # All vertices are the same circle, so blit them all in one call.
+                sprite = self.get_vertex_sprite()
+                r = self.vertex_radius
+                vertex_surf.blits([(sprite, (x - r, y - r)) for (x, y) in coords.tolist()],
+                    doreturn = False)
+                frame_profiler.count("blits", len(coords))
+
+                if self.label_font is not None and self.layout_graph is not None:
+                    ids = self.layout_graph.vertex_ids()
+                    if vertices is not None: ids = ids[vertices]
+                    # Rendered labels are cached, so only new IDs are rendered.
+                    labels = [text_cache.render(self.label_font, str(i), True, self.label_color)
+                        for i in ids.tolist()]
+                    vertex_surf.blits([(label, (x - label.get_width() / 2, y - label.get_height() / 2))
+                        for (label, (x, y)) in zip(labels, coords.tolist())], doreturn = False)
+                    frame_profiler.count("blits", len(labels))
+
+            # Ring around the vertex under the mouse.
+            hovered = self.get_vertex_index(self.hovered_vertex)
+            if hovered is not None:
+                (x, y) = self.layout_to_screen(self.vertex_coords[hovered]) - offset
+                pygame.draw.circle(vertex_surf, self.hover_color, (x, y), self.vertex_radius, 2)
+                frame_profiler.count("draw_calls")
+
+            # Nothing is drawn outside the rect, where the background isn't cleared.
+            inside = rect.move(-area.x, -area.y)
+            surface.blit(edge_surf, rect.topleft, inside)
+            surface.blit(vertex_surf, rect.topleft, inside)
+            frame_profiler.count("blits", 2)
+            self.dirty_rects.append(rect)
             self.changed = False
 
-# Plots lists of numbers
+# A growable list of numbers, with min/max pyramids on top: level l holds the [min, max]
+# of every block of 2^l values. Drawing at any width then only has to read about one
+# block per pixel column, and the overall min/max is the top of the pyramid.
+class PlotSeries:
+    MIN_CAPACITY : int = 16
+
+    def __init__(self, data : List[float] = []) -> None:
+        self.size : int = 0
+        # levels[l] has shape (capacity >> l, 2). Level 0 is the data itself.
+        self.levels : List[np.array] = []
+        self.extend(data)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # The values, as a view (not a copy).
+    def values(self) -> np.array:
+        if len(self.levels) == 0: return np.zeros(0)
+        return self.levels[0][:self.size, 0]
+
+    def min(self) -> float:
+        return float(self.levels[-1][0, 0])
+
+    def max(self) -> float:
+        return float(self.levels[-1][0, 1])
+
+    # Number of blocks at a level.
+    def level_size(self, level : int) -> int:
+        return -(-self.size // (1 << level))
+
+    # Appends values. Only the blocks at the end of each level are updated, so this is
+    # O(len(values) + log(size)).
+    def extend(self, values) -> None:
+        values = np.asarray(values, dtype = np.float64).ravel()
+        if len(values) == 0: return
+        old_size = self.size
+        self.size += len(values)
+
+        capacity = len(self.levels[0]) if len(self.levels) else 0
+        if self.size > capacity:
+            capacity = max(self.MIN_CAPACITY, capacity)
+            while capacity < self.size: capacity *= 2
+            levels = []
+            for l in range(capacity.bit_length()):
+                level = np.empty((max(capacity >> l, 1), 2))
+                if l < len(self.levels): level[:len(self.levels[l])] = self.levels[l]
+                levels.append(level)
+            self.levels = levels
+
+        self.levels[0][old_size:self.size] = values[:, None]
+        for l in range(1, len(self.levels)):
+            first = old_size >> l
+            last = self.level_size(l)
+            below = self.levels[l - 1][2 * first:min(2 * last, self.level_size(l - 1))]
+            # A block at the end can have only one half, pair it with itself.
+            if len(below) % 2: below = np.concatenate([below, below[-1:]])
+            below = below.reshape(-1, 2, 2)
+            self.levels[l][first:last, 0] = below[:, :, 0].min(axis = 1)
+            self.levels[l][first:last, 1] = below[:, :, 1].max(axis = 1)
+
+    # Returns the [min, max] of the values falling into each of width columns. Columns
+    # are rounded to whole blocks of the finest level with at least one block per
+    # column, so this reads O(width) blocks no matter how big the series is.
+    def columns(self, width : int) -> np.array:
+        width = max(min(width, self.size), 1)
+        level = max((self.size // width).bit_length() - 1, 0)
+        blocks = self.levels[level][:self.level_size(level)]
+        starts = (np.arange(width) * self.size // width) >> level
+        return np.stack([np.minimum.reduceat(blocks[:, 0], starts),
+            np.maximum.reduceat(blocks[:, 1], starts)], axis = 1)
+
+# Plots lists of numbers. When there are more values than pixel columns, each column
+# draws the range of the values in it (see PlotSeries) instead of every value.
+# Values can be streamed in with append.
 class Plotter(UIObject):
     def __init__(self, x : float = 0, y : float = 0, width : float = 0, height : float = 0,
             bg_color : Tuple[int] = (0, 0, 0), scaling_axis : int = AxisType.BOTH,
@@ -93,41 +427,78 @@ class Plotter(UIObject):
         self.draw_lines : bool = draw_lines
         self.draw_points : bool = draw_points
 
-        self.data : List[float] = data
+        self.series : PlotSeries = PlotSeries(data)
+
+    @property
+    def data(self) -> np.array:
+        return self.series.values()
+
+    @data.setter
+    def data(self, data : List[float]) -> None:
+        self.series = PlotSeries(data)
+        self.changed = True
+
+    # Adds values to the end of the plot.
+    def append(self, values : List[float]) -> None:
+        self.series.extend(values)
+        self.changed = True
+
+    # Returns the points to draw, in pixels relative to the rect: every value, or the
+    # min and max of every column if there are more values than columns.
+    def get_points(self, rect : pygame.Rect) -> np.array:
+        n = len(self.series)
+        (data_min, data_max) = (self.series.min(), self.series.max())
+        scale_x = rect.width / n
+        scale_y = rect.height / max(abs(data_max) + abs(data_min), 1e-12)
+        y_offset = data_min * scale_y
+
+        if n <= rect.width:
+            x = np.floor(np.arange(n) * scale_x)
+            values = self.series.values()
+        else:
+            columns = self.series.columns(rect.width)
+            x = np.repeat(np.arange(len(columns)), 2)
+            values = columns.ravel()
+        y = rect.height - np.floor(values * scale_y - y_offset)
+        return np.stack([x, y], axis = 1)
 
     def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
             p_width : float = 0, p_height : float = 0) -> None:
         if self.changed:
             # Background
-            rect = rect_from_p(self.x, self.y, self.width, self.height,
-                p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+            rect = self.get_rect(p_x, p_y, p_width, p_height)
             pygame.draw.rect(surface, self.bg_color, rect)
-
-            scale_x = rect.width / len(self.data)
-            scale_y = rect.height / (abs(max(self.data)) + abs(min(self.data)))
-            y_offset = min(self.data) * scale_y
+            frame_profiler.count("draw_calls")
+            if len(self.series) == 0:
+                self.dirty_rects.append(rect)
+                self.changed = False
+                return
 
             # Draw plot
-            line_surf = pygame.Surface((p_width, p_height), pygame.SRCALPHA)
-            line_surf.fill((0, 0, 0, 0))
-
-            point_surf = pygame.Surface((p_width, p_height), pygame.SRCALPHA)
-            point_surf.fill((0, 0, 0, 0))
-
-            i = 0
-            prev_pos = (0, 0)
-            for v in self.data:
-                x = (int) (i * scale_x)
-                y = rect.height - (int) ((v * scale_y) - y_offset)
-                if self.draw_lines: pygame.draw.line(line_surf, self.line_color, prev_pos, (x, y), self.line_width)
-                if self.draw_points: pygame.draw.circle(point_surf, self.point_color, (x, y), self.point_radius)
-                prev_pos = (x, y)
-                i += 1
-            surface.blit(line_surf, (rect.x, rect.y))
-            surface.blit(point_surf, (rect.x, rect.y))
+            # Points on the border stick out of the rect, so the layers have a margin.
+            margin = self.point_radius + self.line_width
+            area = rect.inflate(2 * margin, 2 * margin)
+            line_surf = self.get_layer("lines", area.size)
+            point_surf = self.get_layer("points", area.size)
+
+            points = (self.get_points(rect) + margin).tolist()
+            if self.draw_lines:
+                # Starts from the top left corner, like the plot always has.
+                pygame.draw.lines(line_surf, self.line_color, False, [(margin, margin)] + points,
+                    self.line_width)
+                frame_profiler.count("draw_calls")
+            if self.draw_points:
+                for point in points:
+                    pygame.draw.circle(point_surf, self.point_color, point, self.point_radius)
+                frame_profiler.count("draw_calls", len(points))
+            surface.blit(line_surf, area.topleft)
+            surface.blit(point_surf, area.topleft)
+            frame_profiler.count("blits", 2)
+            self.dirty_rects.append(area)
             self.changed = False
 
-# Plots the sprectum of the eigenvalues of a graph.
+# Plots the sprectum of the eigenvalues of a graph. If a LayoutWorker is given, the
+# eigenvalues are computed in the background and the plot updates when they are ready.
 class Spectrum(Widget):
     ROUNDING : int = 2      # Number of digits to round to
     def __init__(self, x : float = 0, y : float = 0, width : float = 0, height : float = 0,
@@ -138,13 +509,14 @@ class Spectrum(Widget):
             line_width : int = 1, point_radius : int = 5,
             draw_lines : bool = True, draw_points : bool = False,
             eig_mode : int = EigMode.ADJ, plotter_padding : float = 0.1,
-            font : pygame.font.Font = None) -> None:
+            font : pygame.font.Font = None, worker : LayoutWorker = None) -> None:
         super().__init__(x, y, width, height, bg_color, objects, scaling_axis, coord_axis)
 
         self.graph : Graph = graph
         self.eig_mode : int = eig_mode
         self.plotter_padding : float = plotter_padding
         self.font : pygame.font = font
+        self.worker : LayoutWorker = worker
 
         # TODO: Again, need to fix bg color not transparent.
         self.plotter : Plotter = Plotter(plotter_padding, plotter_padding,
@@ -152,44 +524,84 @@ class Spectrum(Widget):
             line_color = line_color, point_color = point_color, line_width = line_width,
             point_radius = point_radius, draw_lines = draw_lines,
             draw_points = draw_points)
-        self.plotter.data = self.graph.get_eig_vals(self.eig_mode)
         self.objects.append(self.plotter)
 
-        data_max : float = max(self.plotter.data)
-        data_min : float = min(self.plotter.data)
+        self.max_text : Text = None
+        self.min_text : Text = None
+        self.zero_text : Text = None
+        self.mid_text : Text = None
+
+        # Version of the graph the plotted eigenvalues are for.
+        self.data_version : int = -1
+        if self.worker is None:
+            self.set_data(self.graph.get_eig_vals(self.eig_mode))
+            self.data_version = self.graph.version
+        else:
+            self.worker.add_eig_mode(self.eig_mode)
+            self.set_data([])
+
+    # Plots new eigenvalues and updates the labels.
+    def set_data(self, data : List[float]) -> None:
+        self.plotter.data = data
+        for label in (self.max_text, self.min_text, self.zero_text, self.mid_text):
+            if label is not None: self.objects.remove(label)
+        (self.max_text, self.min_text, self.zero_text, self.mid_text) = (None, None, None, None)
+        self.set_all_changed()
+        if len(data) == 0: return
+
+        data_max : float = self.plotter.series.max()
+        data_min : float = self.plotter.series.min()
         data_mid : float = (data_max + data_min) / 2
 
-        self.max_text : Text = Text(self.plotter_padding / 4, plotter_padding,
+        self.max_text = Text(self.plotter_padding / 4, self.plotter_padding,
             bg_color = self.bg_color, text = str(round(data_max, self.ROUNDING)),
             font = self.font)
         self.objects.append(self.max_text)
 
-        self.min_text : Text = Text(self.plotter_padding / 4, 1 - plotter_padding,
+        self.min_text = Text(self.plotter_padding / 4, 1 - self.plotter_padding,
             bg_color = self.bg_color, text = str(round(data_min, self.ROUNDING)),
             font = self.font)
         self.objects.append(self.min_text)
 
         # Dont have text for 0 if the min or the max is 0.
         if round(data_max, self.ROUNDING) != 0 and round(data_min, self.ROUNDING) != 0:
-            self.zero_text : Text = Text(self.plotter_padding / 4,
+            self.zero_text = Text(self.plotter_padding / 4,
                 map_range(0, data_min, data_max, self.plotter_padding,
                     1 - self.plotter_padding),
                 bg_color = self.bg_color, text = "0", font = self.font)
             self.objects.append(self.zero_text)
-        else:
-            self.zero_text = None
 
         # Dont have mid text if the mid is 0, max, or min.
         if (round(data_max, self.ROUNDING) != round(data_mid, self.ROUNDING)
                 and round(data_min, self.ROUNDING) != round(data_mid, self.ROUNDING)
                 and round(data_mid, self.ROUNDING) != 0):
-            self.mid_text : Text = Text(self.plotter_padding / 4,
+            self.mid_text = Text(self.plotter_padding / 4,
                 map_range(data_mid, data_min, data_max, self.plotter_padding,
                     1 - self.plotter_padding),
                 bg_color = self.bg_color, text = str(round(data_mid, self.ROUNDING)), font = self.font)
             self.objects.append(self.mid_text)
-        else:
-            self.mid_text = None
+
+    def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
+            p_width : float = 0, p_height : float = 0) -> None:
+        if self.worker is not None:
+            self.worker.request()
+            result = self.worker.result
+            if (result is not None and result.version != self.data_version
+                    and self.eig_mode in result.eig_vals):
+                self.set_data(result.eig_vals[self.eig_mode])
+                self.data_version = result.version
+        elif self.graph.version != self.data_version:
+            self.set_data(self.graph.get_eig_vals(self.eig_mode))
+            self.data_version = self.graph.version
+        super().draw(surface, p_x, p_y, p_width, p_height)
+
+    def is_busy(self) -> bool:
+        if super().is_busy(): return True
+        if self.worker is None: return self.graph.version != self.data_version
+        result = self.worker.result
+        return (self.worker.is_computing() or self.graph.version != self.worker.requested_version
+            or (result is not None and self.eig_mode in result.eig_vals
+                and result.version != self.data_version))
 
 # Combines the GraphUIObject and Spectrum into one widget.
 class GraphVisualizer(Widget):
@@ -203,20 +615,29 @@ class GraphVisualizer(Widget):
             eig_mode : int = EigMode.ADJ, plotter_padding : float = 0.1,
             font : pygame.font.Font = None, vertex_radius : int = 10,
             vertex_color : Tuple[int] = (255, 0, 0), edge_width : int = 1,
-            edge_color : Tuple[int] = (255, 255, 255)) -> None:
+            edge_color : Tuple[int] = (255, 255, 255), background : bool = True,
+            raster_threshold : int = RASTER_THRESHOLD,
+            on_vertex_click : Callable[[int], None] = None,
+            label_font : pygame.font.Font = None) -> None:
         super().__init__(x, y, width, height, bg_color, objects, scaling_axis, coord_axis)
         self.graph : Graph = graph
 
+        # Shared by the spectrum and graph, so the graph is only decomposed once.
+        self.worker : LayoutWorker = LayoutWorker(self.graph) if background else None
+
         self.spectrum : Spectrum = Spectrum(0, 0, 0.5, 1, self.bg_color, graph = self.graph,
             line_color = line_color, point_color = point_color, line_width = line_width,
             point_radius = point_radius, draw_lines = draw_lines, draw_points = draw_points,
-            eig_mode = eig_mode, plotter_padding = plotter_padding, font = font)
+            eig_mode = eig_mode, plotter_padding = plotter_padding, font = font,
+            worker = self.worker)
         self.objects.append(self.spectrum)
 
         self.graph_UIObject : GraphUIObject = GraphUIObject(0.5 + plotter_padding,
             plotter_padding, 0.5 - (plotter_padding * 2), 1 - (plotter_padding *2),
             self.bg_color, graph = self.graph, vertex_radius = vertex_radius,
-            vertex_color = vertex_color, edge_width = edge_width, edge_color = edge_color)        
+            vertex_color = vertex_color, edge_width = edge_width, edge_color = edge_color,
+            worker = self.worker, raster_threshold = raster_threshold,
+            on_vertex_click = on_vertex_click, label_font = label_font)
         self.objects.append(self.graph_UIObject)
 
 
@@ -0,0 +1,81 @@
+from graph import Graph
+from typing import List, Callable
+import threading
+import queue
+
+# Layout (and spectra) computed for one version of a graph.
+class LayoutResult:
+    def __init__(self, graph : Graph, coords, eig_vals : dict) -> None:
+        self.version : int = graph.version
+        self.graph : Graph = graph      # Snapshot of the graph the layout is for
+        self.coords = coords
+        self.eig_vals : dict = eig_vals # Maps EigMode to eigenvalues
+
+# Computes the layout and spectra of a graph on a background thread, so that drawing
+# never has to wait for an eigendecomposition. Call request whenever the graph might
+# have changed, and use result, which always holds the newest finished LayoutResult
+# (or None). If the graph changes again while a layout is being computed, the older
+# requests that are still queued are dropped.
+class LayoutWorker:
+    def __init__(self, graph : Graph, eig_modes : List[int] = [],
+            on_result : Callable = None) -> None:
+        self.graph : Graph = graph
+        self.eig_modes : List[int] = list(eig_modes)
+        # Called (from the worker thread) with every new result.
+        self.on_result : Callable = on_result
+
+        self.result : LayoutResult = None
+        self.requested_version : int = -1
+        # Newest version whose layout failed. The last good result stays in result.
+        self.failed_version : int = -1
+        self.requests : queue.Queue = queue.Queue()
+        self.thread : threading.Thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    # Also computes the eigenvalues for the given EigMode from now on.
+    def add_eig_mode(self, mode : int) -> None:
+        if mode not in self.eig_modes:
+            self.eig_modes.append(mode)
+            self.requested_version = -1
+
+    # Queues up the current version of the graph, if it hasn't been already.
+    def request(self) -> None:
+        if self.graph.version == self.requested_version: return
+        self.requested_version = self.graph.version
+        self.requests.put(self.graph.snapshot())
+
+    # Whether the newest version of the graph is still being worked on.
+    # A failed version counts as done, so the UI can settle instead of waiting forever.
+    def is_computing(self) -> bool:
+        if self.failed_version == self.requested_version: return False
+        return self.result is None or self.result.version != self.requested_version
+
+    def close(self) -> None:
+        self.requests.put(None)
+
+    def run(self) -> None:
+        prev : Graph = None
+        while True:
+            snapshot = self.requests.get()
+            # Only the newest version matters, skip any older ones still in the queue.
+            while snapshot is not None and not self.requests.empty():
+                newer = self.requests.get()
+                if newer is not None: newer.deltas = snapshot.deltas + newer.deltas
+                snapshot = newer
+            if snapshot is None: return
+
+            # Lets incremental graphs refine the last layout instead of starting over.
+            if prev is not None and snapshot.layout_cache[0] != snapshot.version:
+                snapshot.layout_cache = prev.layout_cache
+            try:
+                coords = snapshot.get_coords()
+                eig_vals = {mode: snapshot.get_eig_vals(mode) for mode in self.eig_modes}
+            except Exception as e:
+                print(f"ERROR: could not compute layout for version {snapshot.version}: {e}")
+                self.failed_version = snapshot.version
+                continue
+
+            # Swapping in the whole result at once means readers never see half of it.
+            self.result = LayoutResult(snapshot, coords, eig_vals)
+            prev = snapshot
+            if self.on_result is not None: self.on_result(self.result)
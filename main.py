@@ -1,34 +1,41 @@
 from graphVizUI import GraphUIObject, Spectrum, GraphVisualizer
 from pyUI import Screen
-from graph import Graph
-import numpy as np
+from generators import hypercube
+from graphIO import load_graph
+from frameProfiler import frame_profiler
+import argparse
+import time
 import pygame
 
+parser = argparse.ArgumentParser(description = "Spectral graph viewer.")
+parser.add_argument("path", nargs = "?", default = None,
+    help = "Edge list (.txt, .csv) or Matrix Market (.mtx) file to view. Shows a cube if not given.")
+args = parser.parse_args()
+
 (WIDTH, HEIGHT) = (1440, 720)
 screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
 pygame.init()
 default_font = pygame.font.Font('freesansbold.ttf', 20)
 
-matrix = np.array([
-    [0, 1, 0, 1, 1, 0, 0, 0],
-    [1, 0, 1, 0, 0, 1, 0, 0],
-    [0, 1, 0, 1, 0, 0, 1, 0],
-    [1, 0, 1, 0, 0, 0, 0, 1],
-    [1, 0, 0, 0, 0, 1, 0, 1],
-    [0, 1, 0, 0, 1, 0, 1, 0],
-    [0, 0, 1, 0, 0, 1, 0, 1],
-    [0, 0, 0, 1, 1, 0, 1, 0]
-])
-
-graph = Graph(matrix)
+graph = hypercube(3, sparse = False)
+if args.path is not None:
+    # Uses (or writes) a snapshot next to the file, so only the first load is slow.
+    (graph, labels) = load_graph(args.path)
+    if graph is None: exit(1)
 
-g = GraphVisualizer(0, 0, 1, 1, (0, 0, 0), graph = graph, font = default_font)
+# Clicking a vertex adds a new vertex connected to it.
+g = GraphVisualizer(0, 0, 1, 1, (0, 0, 0), graph = graph, font = default_font,
+    on_vertex_click = lambda vertex_id: graph.add_vertex([vertex_id]))
 
 
 s = Screen(0, 0, WIDTH, HEIGHT, objects = [g])
 
+ZOOM_FACTOR = 1.35      # Zoom per mouse wheel step
+dragging = False
+
 while True:
-    for event in pygame.event.get():
+    # Blocks while nothing is changing, so an idle window doesn't use any CPU.
+    for event in s.get_events():
         match event.type:
             case pygame.QUIT:
                 exit(0)
@@ -36,6 +43,38 @@ while True:
                 s.width = screen.get_width()
                 s.height = screen.get_height()
                 s.set_all_changed()
+            case pygame.KEYDOWN:
+                # F runs a force directed layout, a few steps per frame.
+                if event.key == pygame.K_f:
+                    s.add_task(g.graph_UIObject.layout_task())
+                # R resets the zoom and panning.
+                if event.key == pygame.K_r:
+                    g.graph_UIObject.reset_view()
+                # P shows the frame profiler, T saves what it recorded as a trace file.
+                if event.key == pygame.K_p:
+                    s.toggle_profiler()
+                if event.key == pygame.K_t:
+                    frame_profiler.export_trace(f"trace-{time.strftime('%Y%m%d-%H%M%S')}.json")
+            case pygame.MOUSEWHEEL:
+                pos = pygame.mouse.get_pos()
+                rect = g.graph_UIObject.rect
+                if rect is not None and rect.collidepoint(pos):
+                    g.graph_UIObject.zoom_at(ZOOM_FACTOR ** event.y, pos)
+            case pygame.MOUSEBUTTONDOWN:
+                if event.button == 1: s.activate_click(event.pos)
+                # Right clicking a vertex removes it.
+                if event.button == 3:
+                    vertex_id = g.graph_UIObject.pick_vertex(event.pos)
+                    if vertex_id is not None: graph.remove_vertex(vertex_id)
+                rect = g.graph_UIObject.rect
+                if event.button == 1 and rect is not None and rect.collidepoint(event.pos):
+                    dragging = True
+            case pygame.MOUSEBUTTONUP:
+                if event.button == 1: dragging = False
+            case pygame.MOUSEMOTION:
+                if dragging: g.graph_UIObject.pan(*event.rel)
+                else: s.activate_hover(event.pos)
+    s.run_tasks()
     # s.draw(screen, 0, 0, WIDTH, HEIGHT)
-    s.draw(screen)
-    pygame.display.flip()
\ No newline at end of file
+    # Only the areas that were redrawn are pushed to the window.
+    s.draw(screen)
\ No newline at end of file
@@ -1,5 +1,12 @@
 import pygame
+from frameProfiler import frame_profiler, FrameProfiler, PERCENTILES
 from typing import List, Tuple, Callable
+from collections import OrderedDict
+import time
+
+TEXT_CACHE_BYTES = 16 * 2**20   # Default memory bound of the rendered text cache.
+OVERLAY_FONT_SIZE = 18
+OVERLAY_ROWS = 16               # Most metrics shown by the profiler overlay.
 
 # Scaling Axis enum
 class AxisType:
@@ -52,6 +59,119 @@ def point_in_bounds(x1 : int, y1 : int, w1 : int, h1 : int, x2 : int, y2 : int)
 def point_in_rect(rect : pygame.Rect, point : Tuple[int]) -> bool:
     return point_in_bounds(rect.x, rect.y, rect.width, rect.height, point[0], point[1])
 
+# LRU cache of rendered text surfaces, keyed by (text, font, color, antialias), so
+# the same string is only rendered once. Least recently used surfaces are dropped once
+# they take up more than max_bytes.
+class TextCache:
+    def __init__(self, max_bytes : int = TEXT_CACHE_BYTES) -> None:
+        self.max_bytes : int = max_bytes
+        self.surfaces : OrderedDict = OrderedDict()
+        self.bytes : int = 0
+        self.hits : int = 0
+        self.misses : int = 0
+
+    # Same as font.render(text, antialias, color), but cached. Don't draw on the result.
+    def render(self, font : pygame.font.Font, text : str, antialias : bool,
+            color : Tuple[int]) -> pygame.Surface:
+        key = (text, font, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        frame_profiler.count("surfaces")
+        self.surfaces[key] = surface
+        self.bytes += surface_bytes(surface)
+        # Always keeps the newest, even if it alone is over the bound.
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            (_, old) = self.surfaces.popitem(last = False)
+            self.bytes -= surface_bytes(old)
+        return surface
+
+    def clear(self) -> None:
+        self.surfaces.clear()
+        self.bytes = 0
+
+# Shared by everything that draws text.
+text_cache : TextCache = TextCache()
+
+def surface_bytes(surface : pygame.Surface) -> int:
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+# On-screen table of the frame profiler's metrics, with their rolling percentiles. It is
+# drawn over everything else, so it keeps a copy of what it covers (backing) and puts
+# that back before the next frame is drawn.
+class ProfilerOverlay:
+    def __init__(self, profiler : FrameProfiler, pos : Tuple[int] = (8, 8),
+            font : pygame.font.Font = None, text_color : Tuple[int] = (255, 255, 255),
+            bg_color : Tuple[int] = (0, 0, 0), rows : int = OVERLAY_ROWS) -> None:
+        self.profiler : FrameProfiler = profiler
+        self.pos : Tuple[int] = pos
+        self.font : pygame.font.Font = font
+        self.text_color : Tuple[int] = text_color
+        self.bg_color : Tuple[int] = bg_color
+        self.rows : int = rows
+
+        self.visible : bool = False
+        # Whether the overlay has to be drawn (or removed) in the next frame.
+        self.pending : bool = False
+        # Area covered by the overlay, None if it isn't on the surface.
+        self.rect : pygame.Rect = None
+        self.backing : pygame.Surface = None
+
+    def toggle(self) -> None:
+        self.visible = not self.visible
+        self.pending = True
+
+    # Returns the rows of the table: a header, then one row per metric.
+    def get_rows(self) -> List[List[str]]:
+        rows = [["ms / count", *(f"p{p}" for p in PERCENTILES)]]
+        for name in self.profiler.metrics()[:self.rows]:
+            values = self.profiler.percentiles(name)
+            # Timings (named "category name") are in ms, the rest are counts.
+            if " " in name or name == "frame": rows.append([name, *(f"{v:.2f}" for v in values)])
+            else: rows.append([name, *(f"{v:.0f}" for v in values)])
+        return rows
+
+    # Puts back what the overlay covered, and returns the area (None if nothing was).
+    def restore(self, surface : pygame.Surface) -> pygame.Rect:
+        rect = self.rect
+        if rect is not None:
+            surface.blit(self.backing, rect.topleft, pygame.Rect(0, 0, rect.width, rect.height))
+            self.rect = None
+        return rect
+
+    # Draws the overlay and returns the area it covers.
+    def draw(self, surface : pygame.Surface) -> pygame.Rect:
+        if self.font is None: self.font = pygame.font.Font(None, OVERLAY_FONT_SIZE)
+        # Rendered directly, the numbers change every frame so caching would only push
+        # useful text out of text_cache.
+        cells = [[self.font.render(text, True, self.text_color) for text in row]
+            for row in self.get_rows()]
+        padding = 4
+        widths = [max(row[i].get_width() for row in cells) + 2 * padding for i in range(len(cells[0]))]
+        line_height = self.font.get_linesize()
+        rect = pygame.Rect(self.pos, (sum(widths), line_height * len(cells) + 2 * padding))
+        rect = rect.clip(surface.get_rect())
+
+        if self.backing is None or not self.backing.get_rect().contains(pygame.Rect((0, 0), rect.size)):
+            self.backing = pygame.Surface((max(rect.width, 1), max(rect.height, 1)))
+        self.backing.blit(surface, (0, 0), rect)
+        self.rect = rect
+
+        surface.fill(self.bg_color, rect)
+        for (i, row) in enumerate(cells):
+            x = rect.x
+            for (j, cell) in enumerate(row):
+                # Names are left aligned, numbers right aligned.
+                offset = padding if j == 0 else widths[j] - padding - cell.get_width()
+                surface.blit(cell, (x + offset, rect.y + padding + i * line_height))
+                x += widths[j]
+        return rect
+
 # A drawable UI Object. Coords (x, y) and size (width, height) are percentages (0-1)
 # of its parent widget.
 # Scaling axis: can be BOTH (0), X (1), or Y (2). Determines what axis will be used for size scaling.
@@ -59,7 +179,12 @@ def point_in_rect(rect : pygame.Rect, point : Tuple[int]) -> bool:
 # both will be scaled by width, and Y means both will be scaled by height. This is useful,
 # for example, if you want an object to be a square no matter how the window resizes.
 # Coord axis is the same but for coordinates.
+# The pixel rect of an object is only worked out again when its parent's rect or one of
+# its own LAYOUT_ATTRS changes (see get_rect), so drawing doesn't redo the layout.
 class UIObject:
+    # Attributes that decide the object's rect. Setting any of them clears the cached rect.
+    LAYOUT_ATTRS = {"x", "y", "width", "height", "scaling_axis", "coord_axis"}
+
     def __init__(self, x : float = 0, y : float = 0,
             width : float = 0, height : float = 0, bg_color : Tuple[int] = (0, 0, 0),
             scaling_axis : int = AxisType.BOTH, coord_axis : int = AxisType.BOTH) -> None:
@@ -75,21 +200,82 @@ class UIObject:
         self.changed : bool = True
 
         self.clickable : bool = False   # So that we do not have to check for type Clickable.
+
+        # Pixel rect from the last layout, used for drawing and hit-testing.
+        self.rect : pygame.Rect = None
+        # Parent (x, y, width, height) in pixels that rect was worked out for.
+        self.p_rect : Tuple[float] = None
+        # Areas of the surface (in pixels) redrawn since they were last collected.
+        self.dirty_rects : List[pygame.Rect] = []
+        # Surfaces kept between draws, by name. See get_layer.
+        self.layers : dict = {}
     
     # Draws the object on the provided screen. The parent coords and size are in pixels,
     # not percentages.
     def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
             p_width : float = 0, p_height : float = 0) -> None:
         if self.changed:
-            rect = rect_from_p(self.x, self.y, self.width, self.height,
-                p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+            rect = self.get_rect(p_x, p_y, p_width, p_height)
             pygame.draw.rect(surface, self.bg_color, rect)
+            frame_profiler.count("draw_calls")
+            self.dirty_rects.append(rect)
             self.changed = False
+
+    def __setattr__(self, name : str, value) -> None:
+        object.__setattr__(self, name, value)
+        if name in UIObject.LAYOUT_ATTRS: object.__setattr__(self, "rect", None)
+
+    # Returns the object's pixel rect inside the given parent rect (in pixels). Cached, so
+    # this is only a comparison unless the parent or the object moved or resized.
+    def get_rect(self, p_x : float = 0, p_y : float = 0, p_width : float = 0,
+            p_height : float = 0) -> pygame.Rect:
+        p_rect = (p_x, p_y, p_width, p_height)
+        if self.rect is None or self.p_rect != p_rect:
+            self.rect = rect_from_p(self.x, self.y, self.width, self.height,
+                p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+            self.p_rect = p_rect
+        return self.rect
+
+    # Works out the rects of the object (and its children) without drawing anything.
+    def layout(self, p_x : float = 0, p_y : float = 0, p_width : float = 0,
+            p_height : float = 0) -> None:
+        self.get_rect(p_x, p_y, p_width, p_height)
+
+    # Returns a cleared transparent surface of the given size. The surface is kept and
+    # reused for the next draw, and only reallocated when the size changes.
+    def get_layer(self, name : str, size : Tuple[int]) -> pygame.Surface:
+        size = (max(int(size[0]), 1), max(int(size[1]), 1))
+        layer = self.layers.get(name)
+        if layer is None or layer.get_size() != size:
+            layer = pygame.Surface(size, pygame.SRCALPHA)
+            frame_profiler.count("surfaces")
+            self.layers[name] = layer
+        layer.fill((0, 0, 0, 0))
+        return layer
+
+    # Returns and clears the areas redrawn by this object.
+    def collect_dirty_rects(self) -> List[pygame.Rect]:
+        rects = self.dirty_rects
+        self.dirty_rects = []
+        return rects
     
     def set_all_changed(self, changed : bool = True):
         self.changed = changed
+
+    # Whether the object needs to be drawn again.
+    def is_changed(self) -> bool:
+        return self.changed
+
+    # Whether the object is waiting on something (e.g. a background computation) and needs
+    # to keep being drawn to pick it up, even though nothing has changed yet.
+    def is_busy(self) -> bool:
+        return False
     
-    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect):
+    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect = None):
+        pass
+
+    # Called with the mouse position whenever it moves.
+    def activate_hover(self, pos : Tuple[int]):
         pass
 
 # A type of UIObject that has other UIObjects.
@@ -104,57 +290,182 @@ class Widget(UIObject):
         self.objects = objects
     def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
             p_width : float = 0, p_height : float = 0) -> None:
-        rect = rect_from_p(self.x, self.y, self.width, self.height,
-            p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+        rect = self.get_rect(p_x, p_y, p_width, p_height)
         if self.changed:
             # TODO: bad to not call super().draw? 
             pygame.draw.rect(surface, self.bg_color, rect)
+            frame_profiler.count("draw_calls")
+            self.dirty_rects.append(rect)
             self.changed = False
         for o in self.objects:
-            o.draw(surface, rect.x, rect.y, rect.width, rect.height)
+            with frame_profiler.span(type(o).__name__, "draw"):
+                o.draw(surface, rect.x, rect.y, rect.width, rect.height)
+
+    def layout(self, p_x : float = 0, p_y : float = 0, p_width : float = 0,
+            p_height : float = 0) -> None:
+        rect = self.get_rect(p_x, p_y, p_width, p_height)
+        for o in self.objects:
+            o.layout(rect.x, rect.y, rect.width, rect.height)
+
+    # Returns and clears the areas redrawn by this widget and all of its children.
+    def collect_dirty_rects(self) -> List[pygame.Rect]:
+        rects = super().collect_dirty_rects()
+        for o in self.objects:
+            rects += o.collect_dirty_rects()
+        return rects
 
     # Recursively sets this object's and all of its children's changed.
     def set_all_changed(self, changed : bool = True):
         self.changed = changed
         for o in self.objects:
             o.set_all_changed(changed)
+
+    def is_changed(self) -> bool:
+        return self.changed or any(o.is_changed() for o in self.objects)
+
+    def is_busy(self) -> bool:
+        return any(o.is_busy() for o in self.objects)
     
-    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect):
-        new_p_rect = rect_from_p(self.x, self.y, self.width, self.height,
-            p_rect.x, p_rect.y, p_rect.width, p_rect.height, self.scaling_axis, self.coord_axis)
+    # Passes the click on to the children under it, using the rects from the last draw.
+    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect = None):
+        for o in self.objects:
+            if o.rect is not None and point_in_rect(o.rect, pos):
+                o.activate_click(pos, self.rect)
+
+    # All children get hovers, so that they also find out when the mouse leaves them.
+    def activate_hover(self, pos : Tuple[int]):
         for o in self.objects:
-            rect = rect_from_p(o.x, o.y, o.width, o.height,
-                new_p_rect.x, new_p_rect.y, new_p_rect.width, new_p_rect.height, o.scaling_axis, o.coord_axis)
-            if point_in_rect(rect, pos):
-                o.activate_click(pos, new_p_rect)
+            o.activate_hover(pos)
 
 # A widget that (should) fill the entire window and be at (0, 0).
 # Its width and height are in pixels, NOT percentages.
 # Can be switched to/from.
+# Also schedules frames: get_events blocks while there is nothing to do, and the frame
+# rate is capped at max_fps while something is animating. Tasks (see add_task) are run
+# every frame for up to task_budget milliseconds.
+# Frames (from get_events to the end of draw) are profiled by frame_profiler while the
+# profiler overlay is shown (see toggle_profiler).
 class Screen(Widget):
     def __init__(self, x: float = 0, y: float = 0, width: float = 0,
             height: float = 0,
             bg_color : Tuple[int] = (0, 0, 0),
             objects: List[UIObject] = [],
             scaling_axis : int = AxisType.BOTH,
-            coord_axis : int = AxisType.BOTH) -> None:
+            coord_axis : int = AxisType.BOTH,
+            max_fps : int = 60, task_budget : float = 8) -> None:
         super().__init__(x, y, width, height, bg_color, objects, scaling_axis, coord_axis)
-    def draw(self, surface : pygame.Surface):
+        self.max_fps : int = max_fps
+        self.task_budget : float = task_budget
+
+        # Per frame work. Each is called repeatedly and returns whether it has more to do.
+        self.tasks : List[Callable[[], bool]] = []
+        self.clock : pygame.time.Clock = pygame.time.Clock()
+        self.profiler_overlay : ProfilerOverlay = ProfilerOverlay(frame_profiler)
+
+    # Adds work to be spread across frames, e.g. simulation steps. The task is called
+    # until it returns False. Returning None means it is waiting on something else (like
+    # a background thread), and it isn't called again until the next frame.
+    def add_task(self, task : Callable[[], bool]) -> None:
+        self.tasks.append(task)
+
+    # Whether there is nothing to draw or run until the next event.
+    def is_idle(self) -> bool:
+        return (len(self.tasks) == 0 and not self.is_changed() and not self.is_busy()
+            and not self.profiler_overlay.pending)
+
+    # Shows or hides the profiler overlay. The profiler only runs while it is shown, but
+    # what it recorded is kept for export_trace.
+    def toggle_profiler(self) -> None:
+        self.profiler_overlay.toggle()
+        frame_profiler.enable(self.profiler_overlay.visible)
+
+    # Returns the events since the last frame. If idle, blocks until there is an event,
+    # otherwise waits just long enough to keep to max_fps.
+    def get_events(self) -> List[pygame.event.Event]:
+        if self.is_idle():
+            events = [pygame.event.wait()]
+            # Don't count the time spent waiting against the next frame.
+            self.clock.tick()
+        else:
+            self.clock.tick(self.max_fps)
+            events = []
+        frame_profiler.begin_frame()
+        return events + pygame.event.get()
+
+    # Runs the tasks in turn until they are all done or the budget is used up. Every
+    # task gets at least one call per frame, even if that goes over the budget.
+    def run_tasks(self) -> None:
+        if len(self.tasks) == 0: return
+        end = time.perf_counter() + self.task_budget / 1000
+        first = True
+        waiting = []
+        with frame_profiler.span("run_tasks", "screen"):
+            while len(self.tasks) > len(waiting) and (first or time.perf_counter() < end):
+                for task in list(self.tasks):
+                    if task in waiting: continue
+                    more = task()
+                    if more is None: waiting.append(task)
+                    elif not more: self.tasks.remove(task)
+                    if not first and time.perf_counter() >= end: break
+                first = False
+
+    # Draws everything that changed and returns the redrawn areas. If the surface is the
+    # display, only those areas are pushed to the window, so frames where nothing changed
+    # cost almost nothing.
+    def draw(self, surface : pygame.Surface) -> List[pygame.Rect]:
+        frame_profiler.begin_frame()
+        overlay_rect = self.profiler_overlay.restore(surface)
+        if overlay_rect is not None: self.dirty_rects.append(overlay_rect)
         if self.changed:
             # Doesn't use Widget's draw because its coords are in pixels,
             # might be bad to do it this way.
-            rect = pygame.Rect(self.x, self.y, self.width, self.height)
+            rect = self.get_rect()
             pygame.draw.rect(surface, self.bg_color, rect)
+            frame_profiler.count("draw_calls")
+            self.dirty_rects.append(rect)
             self.changed = False
         for o in self.objects:
-            o.draw(surface, self.x, self.y, self.width, self.height)
-    def activate_click(self, pos: Tuple[int]):
-        new_p_rect = pygame.Rect(self.x, self.y, self.width, self.height)
+            with frame_profiler.span(type(o).__name__, "draw"):
+                o.draw(surface, self.x, self.y, self.width, self.height)
+        if self.profiler_overlay.visible:
+            with frame_profiler.span("ProfilerOverlay", "draw"):
+                self.dirty_rects.append(self.profiler_overlay.draw(surface))
+        self.profiler_overlay.pending = False
+
+        rects = self.collect_dirty_rects()
+        # Children that spill outside their rect can report areas off the surface.
+        bounds = surface.get_rect()
+        rects = [r.clip(bounds) for r in rects]
+        rects = [r for r in rects if r.width > 0 and r.height > 0]
+        # Drop areas that are covered by another one (e.g. a child inside its redrawn parent).
+        rects = [r for (i, r) in enumerate(rects)
+            if not any(o.contains(r) and (o != r or j < i) for (j, o) in enumerate(rects) if j != i)]
+        if len(rects) and surface is pygame.display.get_surface():
+            with frame_profiler.span("display.update", "screen"):
+                pygame.display.update(rects)
+        frame_profiler.end_frame()
+        return rects
+
+    # The screen's coords and size are already in pixels.
+    def get_rect(self, p_x : float = 0, p_y : float = 0, p_width : float = 0,
+            p_height : float = 0) -> pygame.Rect:
+        if self.rect is None: self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        return self.rect
+
+    def layout(self) -> None:
+        self.get_rect()
         for o in self.objects:
-            rect = rect_from_p(o.x, o.y, o.width, o.height,
-                new_p_rect.x, new_p_rect.y, new_p_rect.width, new_p_rect.height, o.scaling_axis, o.coord_axis)
-            if point_in_rect(rect, pos):
-                o.activate_click(pos, new_p_rect)
+            o.layout(self.x, self.y, self.width, self.height)
+
+    def activate_click(self, pos: Tuple[int]):
+        # Makes sure objects that haven't been drawn since they moved are hit where they
+        # will be drawn.
+        self.layout()
+        super().activate_click(pos)
+
+    def activate_hover(self, pos : Tuple[int]):
+        self.layout()
+        super().activate_hover(pos)
 # ________________________________
 # ----- More Objects/Widgets -----
 # ________________________________
@@ -169,7 +480,7 @@ class Clickable(Widget):
 
         self.clickable = True
 
-    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect):
+    def activate_click(self, pos : Tuple[int], p_rect : pygame.Rect = None):
         self.on_click()
         super().activate_click(pos, p_rect)
 
@@ -190,11 +501,14 @@ class Text(UIObject):
     def draw(self, surface : pygame.Surface, p_x : float = 0, p_y : float = 0,
             p_width : float = 0, p_height : float = 0) -> None:
         if self.changed:
-            rect = rect_from_p(self.x, self.y, self.width, self.height,
-                p_x, p_y, p_width, p_height, scaling_axis = self.scaling_axis, coord_axis=self.coord_axis)
+            rect = self.get_rect(p_x, p_y, p_width, p_height)
             pygame.draw.rect(surface, self.bg_color, rect)
-            text_rect = self.font.render(self.text, False, self.text_color)
-            surface.blit(text_rect, (rect.x, rect.y))
+            frame_profiler.count("draw_calls")
+            text_rect = text_cache.render(self.font, self.text, False, self.text_color)
+            # The text is not clipped to the rect, so report both.
+            text_area = surface.blit(text_rect, (rect.x, rect.y))
+            frame_profiler.count("blits")
+            self.dirty_rects.append(rect.union(text_area))
             self.changed = False
 
 # Clickable with text
@@ -0,0 +1,120 @@
+import pygame
+import numpy as np
+
+# Most line samples generated at once, bounds the memory used by rasterize_lines.
+MAX_BLOCK_SAMPLES = 2**22
+# Most line samples per frame. Beyond this, only an evenly spaced subset of the lines is
+# drawn (each counting for the ones skipped), so the time stays bounded no matter how
+# many (or how long) the edges are.
+MAX_LINE_SAMPLES = 2**24
+# Alpha of a pixel covered once. Denser pixels fade up to 255 on a log scale.
+MIN_ALPHA = 80
+
+# Level of detail rendering for graphs too big to draw one element at a time: edges and
+# vertices are counted into per pixel density buffers (shape (width, height), like
+# pygame.surfarray) with numpy, then drawn onto a layer in one go, with the alpha of
+# each pixel showing how many elements cover it.
+
+# Clips line segments to the buffer (Liang-Barsky). Returns the clipped starts and ends,
+# without the segments that are entirely outside.
+def clip_lines(starts : np.array, ends : np.array, width : int, height : int):
+    # Usually most segments are fully inside, only the others need clipping.
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    inside = ((low[:, 0] >= 0) & (low[:, 1] >= 0)
+        & (high[:, 0] <= width - 1) & (high[:, 1] <= height - 1))
+    if inside.all(): return (starts, ends)
+    outside = ~inside
+    (clipped_starts, clipped_ends) = clip_outside_lines(starts[outside], ends[outside],
+        width, height)
+    return (np.concatenate([starts[inside], clipped_starts]),
+        np.concatenate([ends[inside], clipped_ends]))
+
+def clip_outside_lines(starts : np.array, ends : np.array, width : int, height : int):
+    diff = ends - starts
+    t0 = np.zeros(len(starts))
+    t1 = np.ones(len(starts))
+    keep = np.ones(len(starts), dtype = bool)
+    for (p, q) in ((-diff[:, 0], starts[:, 0]), (diff[:, 0], (width - 1) - starts[:, 0]),
+            (-diff[:, 1], starts[:, 1]), (diff[:, 1], (height - 1) - starts[:, 1])):
+        parallel = p == 0
+        keep &= ~(parallel & (q < 0))
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            t = q / p
+        t0 = np.where(p < 0, np.maximum(t0, t), t0)
+        t1 = np.where(p > 0, np.minimum(t1, t), t1)
+    keep &= t0 <= t1
+    (starts, diff, t0, t1) = (starts[keep], diff[keep], t0[keep], t1[keep])
+    return (starts + diff * t0[:, None], starts + diff * t1[:, None])
+
+# Adds one to every pixel each line segment passes through. Every segment is sampled
+# once per pixel along its longest axis (like a DDA), all segments at once.
+def rasterize_lines(counts : np.array, starts : np.array, ends : np.array,
+        max_samples : int = MAX_LINE_SAMPLES) -> None:
+    (width, height) = counts.shape
+    (starts, ends) = clip_lines(np.asarray(starts, dtype = np.float64),
+        np.asarray(ends, dtype = np.float64), width, height)
+    if len(starts) == 0: return
+    diff = ends - starts
+    lengths = np.ceil(np.abs(diff).max(axis = 1)).astype(np.int64) + 1
+    cum_lengths = np.cumsum(lengths)
+
+    # Too many samples: only draw every factor-th line, counted factor times. Taking
+    # the same lines every frame means the estimate doesn't flicker.
+    factor = int(np.ceil(cum_lengths[-1] / max_samples))
+    if factor > 1:
+        (starts, diff, lengths) = (starts[::factor], diff[::factor], lengths[::factor])
+        cum_lengths = np.cumsum(lengths)
+
+    flat = counts.reshape(-1)
+    first = 0
+    while first < len(starts):
+        done = cum_lengths[first - 1] if first > 0 else 0
+        last = max(int(np.searchsorted(cum_lengths, done + MAX_BLOCK_SAMPLES, side = "right")),
+            first + 1)
+
+        # One sample per pixel: x = start + step * (position along the segment).
+        block_lengths = lengths[first:last]
+        block_starts = np.repeat(cum_lengths[first:last] - block_lengths - done, block_lengths)
+        steps = np.arange(len(block_starts), dtype = np.float32)
+        steps -= block_starts
+        step_sizes = diff[first:last] / np.maximum(block_lengths - 1, 1)[:, None]
+        # Clipped coords are within the buffer, the clip only catches rounding errors.
+        x = np.repeat(step_sizes[:, 0].astype(np.float32), block_lengths) * steps
+        x += np.repeat(starts[first:last, 0].astype(np.float32) + 0.5, block_lengths)
+        y = np.repeat(step_sizes[:, 1].astype(np.float32), block_lengths) * steps
+        y += np.repeat(starts[first:last, 1].astype(np.float32) + 0.5, block_lengths)
+        pixels = np.clip(x.astype(np.int32), 0, width - 1) * height
+        pixels += np.clip(y.astype(np.int32), 0, height - 1)
+        hits = np.bincount(pixels, minlength = width * height).astype(counts.dtype)
+        if factor > 1: hits *= factor
+        flat += hits
+        first = last
+
+# Adds one to the pixel under every point.
+def rasterize_points(counts : np.array, points : np.array) -> None:
+    (width, height) = counts.shape
+    points = np.rint(np.asarray(points, dtype = np.float64)).astype(np.int64)
+    (x, y) = (points[:, 0], points[:, 1])
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    counts.reshape(-1)[:] += np.bincount(x[inside] * height + y[inside],
+        minlength = width * height).astype(counts.dtype)
+
+# Maps densities to alpha on a log scale: 0 stays transparent, 1 is MIN_ALPHA, and the
+# densest pixel is 255.
+def density_alpha(counts : np.array, min_alpha : int = MIN_ALPHA) -> np.array:
+    top = counts.max() if counts.size else 0
+    if top == 0: return np.zeros(counts.shape, dtype = np.uint8)
+    scale = np.log1p(counts) / np.log1p(top) if top > 1 else np.ones(counts.shape)
+    alpha = min_alpha + (255 - min_alpha) * scale
+    return np.where(counts > 0, alpha, 0).astype(np.uint8)
+
+# Fills a SRCALPHA layer (the same size as counts) with the color, faded by density.
+def draw_density(layer : pygame.Surface, counts : np.array, color,
+        min_alpha : int = MIN_ALPHA) -> None:
+    pixels = pygame.surfarray.pixels3d(layer)
+    pixels[:] = color[:3]
+    del pixels      # Unlocks the surface
+    alpha = pygame.surfarray.pixels_alpha(layer)
+    alpha[:] = density_alpha(counts, min_alpha)
+    del alpha
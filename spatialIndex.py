@@ -0,0 +1,91 @@
+from MagSim import expand_ranges
+from typing import Tuple
+import numpy as np
+
+CELL_VERTICES = 4           # Average number of vertices per grid cell.
+MAX_GRID_SIDE = 1024        # Most cells along each axis.
+# Edges whose bounding box covers more cells than this are not put into the grid, they
+# are checked on every query instead. There are usually only a few of them.
+MAX_EDGE_CELLS = 16
+
+# Uniform grid over the vertex coords (and the edges between them), so that finding
+# everything inside a rectangle takes time proportional to what is found, instead of
+# the size of the graph. Cells store their vertices (and the edges whose bounding box
+# overlaps them) in contiguous runs of one sorted array, like a CSR matrix.
+class GridIndex:
+    def __init__(self, coords : np.array, rows : np.array = None, cols : np.array = None) -> None:
+        self.coords : np.array = np.asarray(coords, dtype = np.float64).reshape(-1, 2)
+        n = len(self.coords)
+        self.low : np.array = self.coords.min(axis = 0) if n else np.zeros(2)
+        high = self.coords.max(axis = 0) if n else np.ones(2)
+        self.side : int = int(np.clip(np.ceil(np.sqrt(n / CELL_VERTICES)), 1, MAX_GRID_SIDE))
+        self.cell_size : np.array = np.maximum((high - self.low) / self.side, 1e-12)
+
+        cells = self.cell_of(self.coords)
+        (self.vertex_starts, self.vertices) = self.sort_into_cells(
+            cells[:, 0] * self.side + cells[:, 1], np.arange(n))
+
+        self.rows : np.array = None
+        self.cols : np.array = None
+        self.long_edges : np.array = np.zeros(0, dtype = np.int64)
+        (self.edge_starts, self.edges) = (None, None)
+        if rows is not None: self.add_edges(rows, cols, cells)
+
+    # Returns the (x, y) cell of every point. Points outside the grid get the nearest cell.
+    def cell_of(self, points : np.array) -> np.array:
+        cells = np.floor((np.asarray(points, dtype = np.float64) - self.low) / self.cell_size)
+        return np.clip(cells, 0, self.side - 1).astype(np.int64)
+
+    # Sorts values by cell, and returns (start of every cell's run, sorted values).
+    def sort_into_cells(self, cell_ids : np.array, values : np.array) -> Tuple[np.array]:
+        order = np.argsort(cell_ids, kind = "stable")
+        starts = np.searchsorted(cell_ids[order], np.arange(self.side * self.side + 1))
+        return (starts, values[order])
+
+    # Puts every (short) edge into each cell its bounding box covers.
+    def add_edges(self, rows : np.array, cols : np.array, cells : np.array) -> None:
+        self.rows = np.asarray(rows, dtype = np.int64)
+        self.cols = np.asarray(cols, dtype = np.int64)
+        low = np.minimum(cells[self.rows], cells[self.cols])
+        extent = np.abs(cells[self.rows] - cells[self.cols]) + 1
+        counts = extent[:, 0] * extent[:, 1]
+        short = counts <= MAX_EDGE_CELLS
+        self.long_edges = np.flatnonzero(~short)
+
+        edges = np.flatnonzero(short)
+        (edges, k) = expand_ranges(edges, np.zeros(len(edges), dtype = np.int64), counts[short])
+        heights = extent[edges, 1]
+        x = low[edges, 0] + k // heights
+        y = low[edges, 1] + k % heights
+        (self.edge_starts, self.edges) = self.sort_into_cells(x * self.side + y, edges)
+
+    # Returns everything stored in the cells that overlap the rectangle.
+    def gather(self, starts : np.array, values : np.array, low : np.array,
+            high : np.array) -> np.array:
+        (x0, y0) = self.cell_of(low)
+        (x1, y1) = self.cell_of(high)
+        # The cells of one grid column are next to each other, so each column is one run.
+        columns = np.arange(x0, x1 + 1) * self.side
+        (_, indices) = expand_ranges(columns, starts[columns + y0], starts[columns + y1 + 1])
+        return values[indices]
+
+    # Whether the rectangle covers the whole grid, so queries would return everything.
+    def covers(self, low : np.array, high : np.array) -> bool:
+        return bool(np.all(low <= self.low) and np.all(high >= self.low + self.cell_size * self.side))
+
+    # Returns the indices of the vertices inside the rectangle, sorted.
+    def query_vertices(self, low : np.array, high : np.array) -> np.array:
+        found = self.gather(self.vertex_starts, self.vertices, low, high)
+        points = self.coords[found]
+        inside = np.all((points >= low) & (points <= high), axis = 1)
+        return np.sort(found[inside])
+
+    # Returns the indices of the edges whose bounding box overlaps the rectangle, sorted.
+    def query_edges(self, low : np.array, high : np.array) -> np.array:
+        if self.rows is None: return np.zeros(0, dtype = np.int64)
+        found = np.concatenate([np.unique(self.gather(self.edge_starts, self.edges, low, high)),
+            self.long_edges])
+        (starts, ends) = (self.coords[self.rows[found]], self.coords[self.cols[found]])
+        overlaps = np.all((np.minimum(starts, ends) <= high) & (np.maximum(starts, ends) >= low),
+            axis = 1)
+        return np.sort(found[overlaps])